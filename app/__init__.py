@@ -3,6 +3,7 @@ from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 db = SQLAlchemy()
 migrate = Migrate()
@@ -20,9 +21,23 @@ def create_app(config=None) -> Flask:
 
     app.config.from_object(config)
 
+    # Trust the reverse proxy for the client address
+    if app.config.get("PROXY_FIX_X_FOR"):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"])
+
     # Initialize extentions
     initialize_app_extentions(app=app)
 
+    # Register Jinja fragment cache
+    from . import fragment_cache
+
+    fragment_cache.init_app(app)
+
+    # Register attachment store
+    from . import attachments
+
+    attachments.init_app(app)
+
     # Register SQLAlchemy Events Listener
     from . import events
 
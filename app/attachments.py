@@ -0,0 +1,702 @@
+import hashlib
+import io
+import mimetypes
+import os
+import posixpath
+import tempfile
+import unicodedata
+import uuid
+import zipfile
+from collections.abc import Iterator
+from datetime import datetime
+from typing import IO
+from urllib.parse import quote
+
+from flask import Flask, Response, request, send_file
+from flask import current_app as app
+from sqlalchemy import LargeBinary, delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from werkzeug.datastructures import CombinedMultiDict, ContentRange
+from werkzeug.formparser import parse_form_data
+from werkzeug.utils import import_string, secure_filename
+
+from . import db
+from .models import Attachment, AttachmentBlob, Course
+
+# Storage of the attachments kept in their `file_data` column.
+DATABASE_STORAGE = "database"
+
+# Room left in upload requests for the form fields and multipart framing.
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+# Types compressed already, stored as is in the course archives.
+COMPRESSED_MIMETYPE_PREFIXES = ("image/", "video/", "audio/")
+COMPRESSED_MIMETYPES = {
+    "application/epub+zip",
+    "application/gzip",
+    "application/pdf",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/x-7z-compressed",
+    "application/x-bzip2",
+    "application/x-rar-compressed",
+    "application/x-xz",
+    "application/zip",
+}
+UNCOMPRESSED_MIMETYPES = {"image/bmp", "image/svg+xml", "image/tiff", "audio/x-wav"}
+
+
+class AttachmentQuotaError(Exception):
+    """Raised when an upload goes over the attachment size or course quota."""
+
+
+class AttachmentStore:
+    """Interface of the attachment stores, holding files by their sha256.
+
+    A file shared by several attachments is held once, its references are
+    counted in `AttachmentBlob` by events on the attachments.
+    """
+
+    name = ""
+
+    def make_temp_file(self) -> IO[bytes]:
+        """Open a temporary file to write a file before saving it."""
+        return tempfile.NamedTemporaryFile(delete=False)
+
+    def get_location(self, file_hash: str) -> str:
+        """Where the store holds the file, kept in `Attachment.file_path`."""
+        return file_hash
+
+    def save(self, file_hash: str, path: str) -> None:
+        """Move the file at `path` into the store, unless already held.
+
+        Call it once the attachment is flushed, the flush locks the blob row,
+        so the file cannot be collected meanwhile.
+        """
+        raise NotImplementedError
+
+    def delete(self, file_hash: str) -> None:
+        raise NotImplementedError
+
+    def open(self, file_hash: str) -> IO[bytes]:
+        raise NotImplementedError
+
+    def make_response(self, attachment: Attachment) -> Response:
+        raise NotImplementedError
+
+
+class LocalAttachmentStore(AttachmentStore):
+    """Files kept on the local disk, at `<root>/ab/cd/<sha256>`.
+
+    They are sent through the WSGI file wrapper, which gunicorn serves with
+    sendfile(2), or by nginx with X-Accel-Redirect when `accel_prefix` names
+    an internal location mapped to `root`.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str, accel_prefix: str | None = None):
+        self.root = root
+        self.accel_prefix = accel_prefix
+
+    def get_relative_path(self, file_hash: str) -> str:
+        return posixpath.join(file_hash[:2], file_hash[2:4], file_hash)
+
+    def get_path(self, file_hash: str) -> str:
+        return os.path.join(self.root, self.get_relative_path(file_hash))
+
+    def get_location(self, file_hash: str) -> str:
+        return self.get_relative_path(file_hash)
+
+    def make_temp_file(self) -> IO[bytes]:
+        # Next to the files, so saving is an atomic rename.
+        temp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(temp_dir, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=temp_dir, delete=False)
+
+    def save(self, file_hash: str, path: str) -> None:
+        target = self.get_path(file_hash)
+        if os.path.exists(target):
+            os.remove(path)
+            return
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    def delete(self, file_hash: str) -> None:
+        try:
+            os.remove(self.get_path(file_hash))
+        except FileNotFoundError:
+            pass
+
+    def open(self, file_hash: str) -> IO[bytes]:
+        return open(self.get_path(file_hash), "rb")
+
+    def make_response(self, attachment: Attachment) -> Response:
+        if not self.accel_prefix:
+            return send_file(
+                self.get_path(attachment.file_hash),
+                mimetype=get_mimetype(attachment),
+                as_attachment=True,
+                download_name=attachment.old_filename,
+                etag=attachment.file_hash,
+            )
+
+        if request.if_none_match.contains_weak(attachment.file_hash):
+            return Response(status=304)
+
+        response = Response(mimetype=get_mimetype(attachment))
+        response.headers["X-Accel-Redirect"] = posixpath.join(
+            self.accel_prefix, self.get_relative_path(attachment.file_hash)
+        )
+        _set_download_name(response, attachment.old_filename)
+
+        return response
+
+
+def create_store(app: Flask) -> AttachmentStore:
+    """Create the store named by `ATTACHMENT_STORE`.
+
+    Either `local`, or the import path of an `AttachmentStore` class taking
+    the app.
+    """
+
+    name = app.config.get("ATTACHMENT_STORE", "local")
+
+    if name == "local":
+        root = app.config.get("ATTACHMENT_STORE_DIR")
+        if not root:
+            # The instance folder is lost along with the container.
+            if app.config.get("ENVIRONMENT", "local") != "local" and not app.testing:
+                raise ValueError("ATTACHMENT_STORE_DIR is not set")
+            root = os.path.join(app.instance_path, "attachments")
+
+        return LocalAttachmentStore(
+            root, app.config.get("ATTACHMENT_ACCEL_REDIRECT_PREFIX")
+        )
+
+    return import_string(name)(app)
+
+
+def get_store() -> AttachmentStore:
+    return app.extensions["attachment_store"]
+
+
+def init_app(app: Flask) -> None:
+    """Set up the attachment store."""
+
+    app.extensions["attachment_store"] = create_store(app)
+
+
+def update_blob_refs(connection, file_hash: str, file_size: int, change: int) -> None:
+    """Add the change to the blob references, creating the blob if missing."""
+
+    stmt = pg_insert(AttachmentBlob).values(
+        file_hash=file_hash,
+        file_size=file_size,
+        ref_count=change,
+        created_at=datetime.now(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AttachmentBlob.file_hash],
+        set_={"ref_count": AttachmentBlob.ref_count + change},
+    )
+    connection.execute(stmt)
+
+
+def reserve_blob(file_hash: str, file_size: int) -> None:
+    """Commit the blob row of a file about to be saved in the store.
+
+    The row is only referenced once the attachment using the file commits,
+    so if that transaction fails the saved file is left to `collect_blobs`.
+    """
+
+    with db.engine.begin() as connection:
+        update_blob_refs(connection, file_hash, file_size, 0)
+
+
+def collect_blobs(connection, store: AttachmentStore, limit: int) -> int:
+    """Remove up to `limit` unreferenced blobs, returning how many were.
+
+    The blob rows stay locked until the transaction commits, so an upload of
+    the same file waits for it, and saves the file again.
+    """
+
+    file_hashes = (
+        connection.execute(
+            select(AttachmentBlob.file_hash)
+            .filter(AttachmentBlob.ref_count <= 0)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        .scalars()
+        .all()
+    )
+
+    for file_hash in file_hashes:
+        store.delete(file_hash)
+
+    if file_hashes:
+        connection.execute(
+            delete(AttachmentBlob).filter(AttachmentBlob.file_hash.in_(file_hashes))
+        )
+
+    return len(file_hashes)
+
+
+def move_database_attachments(store: AttachmentStore, batch_size: int) -> int:
+    """Move a batch of attachments from their `file_data` into the store.
+
+    The files are copied chunk by chunk, the caller commits the batch.
+    """
+
+    attachments = (
+        db.session.execute(
+            select(Attachment)
+            .filter(Attachment.storage == DATABASE_STORAGE)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        .scalars()
+        .all()
+    )
+
+    saved = []
+    for attachment in attachments:
+        digest = hashlib.sha256()
+        with store.make_temp_file() as temp:
+            for chunk in iter_file_data(
+                db.engine,
+                attachment.attachment_id,
+                0,
+                attachment.file_size,
+                app.config.get("ATTACHMENT_CHUNK_SIZE", 1024 * 1024),
+            ):
+                digest.update(chunk)
+                temp.write(chunk)
+
+        if digest.hexdigest() != attachment.file_hash:
+            for _file_hash, path in [*saved, (None, temp.name)]:
+                os.remove(path)
+            raise ValueError(f"{attachment!r} file does not match its hash")
+
+        attachment.storage = store.name
+        attachment.file_path = store.get_location(attachment.file_hash)
+        attachment.file_data = None
+        saved.append((attachment.file_hash, temp.name))
+
+    for attachment in attachments:
+        reserve_blob(attachment.file_hash, attachment.file_size)
+
+    db.session.flush()
+    for file_hash, path in saved:
+        store.save(file_hash, path)
+
+    return len(attachments)
+
+
+def get_mimetype(attachment: Attachment) -> str:
+    mimetype, _encoding = mimetypes.guess_type(attachment.old_filename)
+    return mimetype or "application/octet-stream"
+
+
+def iter_file_data(
+    engine, attachment_id: uuid.UUID, start: int, stop: int, chunk_size: int
+) -> Iterator[bytes]:
+    """Yield the attachment bytes from `start` to `stop`, chunk by chunk.
+
+    Each chunk is read with `substring`, so postgres only fetches the TOAST
+    chunks holding it, on a connection checked out for that chunk alone,
+    so slow clients do not hold on to the pool for the whole download.
+    """
+
+    offset = start
+    while offset < stop:
+        length = min(chunk_size, stop - offset)
+        with engine.connect() as connection:
+            chunk = connection.execute(
+                select(
+                    func.substring(
+                        Attachment.file_data, offset + 1, length, type_=LargeBinary
+                    )
+                ).filter(Attachment.attachment_id == attachment_id)
+            ).scalar_one_or_none()
+
+        if not chunk:
+            return
+
+        yield chunk
+        offset += len(chunk)
+
+
+def _set_download_name(response: Response, filename: str) -> None:
+    try:
+        filename.encode("ascii")
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", filename)
+        simple = simple.encode("ascii", "ignore").decode("ascii")
+        quoted = quote(filename, safe="!#$&+-.^_`|~")
+        names = {"filename": simple, "filename*": f"UTF-8''{quoted}"}
+    else:
+        names = {"filename": filename}
+
+    response.headers.set("Content-Disposition", "attachment", **names)
+
+
+def make_database_response(attachment: Attachment) -> Response:
+    """Stream the attachment, answering If-None-Match and single Range requests.
+
+    The attachment is loaded with its `file_data` deferred, the bytes are
+    read in `ATTACHMENT_CHUNK_SIZE` chunks as the response is sent.
+    """
+
+    etag = attachment.file_hash
+    size = attachment.file_size
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        start, stop, status = 0, size, 200
+
+        # Ranges of another version of the file fall back to the whole file,
+        # and so do multiple ranges.
+        byte_range = request.range
+        if byte_range and (
+            "If-Range" not in request.headers or request.if_range.etag == etag
+        ):
+            bounds = byte_range.range_for_length(size)
+            if bounds is not None:
+                (start, stop), status = bounds, 206
+            elif len(byte_range.ranges) == 1:
+                response = Response(status=416)
+                response.content_range = ContentRange("bytes", None, None, size)
+                return response
+
+        response = Response(
+            iter_file_data(
+                db.engine,
+                attachment.attachment_id,
+                start,
+                stop,
+                app.config.get("ATTACHMENT_CHUNK_SIZE", 1024 * 1024),
+            ),
+            status=status,
+            mimetype=get_mimetype(attachment),
+            direct_passthrough=True,
+        )
+        response.content_length = stop - start
+        if status == 206:
+            response.content_range = ContentRange("bytes", start, stop, size)
+        _set_download_name(response, attachment.old_filename)
+
+    return response
+
+
+def iter_attachment_file(
+    store: AttachmentStore, engine, attachment: Attachment, chunk_size: int
+) -> Iterator[bytes]:
+    """Yield the attachment file chunk by chunk, from wherever it is stored."""
+
+    if attachment.storage == DATABASE_STORAGE:
+        yield from iter_file_data(
+            engine, attachment.attachment_id, 0, attachment.file_size, chunk_size
+        )
+        return
+
+    with store.open(attachment.file_hash) as file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+def make_attachment_response(attachment: Attachment) -> Response:
+    """Serve the attachment file from wherever it is stored."""
+
+    if attachment.storage == DATABASE_STORAGE:
+        response = make_database_response(attachment)
+    else:
+        store = get_store()
+        if attachment.storage != store.name:
+            raise LookupError(f"Attachment store {attachment.storage!r} is not set")
+        response = store.make_response(attachment)
+
+    response.accept_ranges = "bytes"
+    response.set_etag(attachment.file_hash)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response
+
+
+# Course archives
+
+
+class _ArchiveBuffer(io.RawIOBase):
+    """Unseekable output of the course archive, drained as it is streamed."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def is_compressed(mimetype: str) -> bool:
+    if mimetype in UNCOMPRESSED_MIMETYPES:
+        return False
+    return mimetype in COMPRESSED_MIMETYPES or mimetype.startswith(
+        COMPRESSED_MIMETYPE_PREFIXES
+    )
+
+
+def get_archive_names(attachments: list[Attachment]) -> list[str]:
+    """Names of the attachments in the archive, told apart when the same."""
+
+    names, seen = [], set()
+    for attachment in attachments:
+        filename = attachment.old_filename.replace("\\", "/").rsplit("/", 1)[-1]
+        stem, ext = os.path.splitext(filename or attachment.new_filename)
+        name, index = stem + ext, 1
+        while name.lower() in seen:
+            index += 1
+            name = f"{stem} ({index}){ext}"
+        seen.add(name.lower())
+        names.append(name)
+
+    return names
+
+
+def iter_course_archive(
+    store: AttachmentStore, engine, attachments: list[Attachment], chunk_size: int
+) -> Iterator[bytes]:
+    """Yield a ZIP archive of the attachments, written as it is streamed.
+
+    Each file is read and compressed chunk by chunk, and the archive
+    entries end with data descriptors, so nothing is held but the current
+    chunk. Files compressed already are stored as is.
+    """
+
+    buffer = _ArchiveBuffer()
+    date_time = datetime.now().timetuple()[:6]
+
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for attachment, name in zip(
+            attachments, get_archive_names(attachments), strict=True
+        ):
+            info = zipfile.ZipInfo(name, date_time)
+            info.file_size = attachment.file_size
+            info.external_attr = 0o644 << 16
+            info.compress_type = (
+                zipfile.ZIP_STORED
+                if is_compressed(get_mimetype(attachment))
+                else zipfile.ZIP_DEFLATED
+            )
+
+            with archive.open(info, "w") as entry:
+                for chunk in iter_attachment_file(
+                    store, engine, attachment, chunk_size
+                ):
+                    entry.write(chunk)
+                    if buffer.chunks:
+                        yield buffer.drain()
+
+            yield buffer.drain()
+
+    yield buffer.drain()
+
+
+def make_course_archive_response(
+    course: Course, attachments: list[Attachment]
+) -> Response:
+    """Stream the course attachments as a ZIP archive."""
+
+    response = Response(
+        iter_course_archive(
+            get_store(),
+            db.engine,
+            attachments,
+            app.config.get("ATTACHMENT_CHUNK_SIZE", 1024 * 1024),
+        ),
+        mimetype="application/zip",
+        direct_passthrough=True,
+    )
+    _set_download_name(response, f"{course.name}.zip")
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response
+
+
+# Uploads
+
+
+class UploadFile:
+    """Uploaded file written straight into a store temporary file.
+
+    The bytes are hashed and counted as they are written, the upload is
+    aborted as soon as it goes over `max_size`.
+    """
+
+    def __init__(self, file: IO[bytes], max_size: int):
+        self.file = file
+        self.name = file.name
+        self.max_size = max_size
+        self.size = 0
+        self.digest = hashlib.sha256()
+
+    @property
+    def file_hash(self) -> str:
+        return self.digest.hexdigest()
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise AttachmentQuotaError(
+                f"Files are limited to {_format_size(self.max_size)} here."
+            )
+
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self.file.seek(offset, whence)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.file.read(size)
+
+    def close(self) -> None:
+        self.file.close()
+
+    def discard(self) -> None:
+        """Remove the temporary file, unless it was saved into the store."""
+
+        self.file.close()
+        try:
+            os.remove(self.name)
+        except FileNotFoundError:
+            pass
+
+
+def _format_size(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / 1024:.1f} KB"
+
+
+def get_course_attachments_size(course_id: uuid.UUID, lock: bool = False) -> int:
+    """Total size of the course attachments, shared files counted each time.
+
+    With `lock`, the course row is locked first so that concurrent uploads
+    check the quota one after the other.
+    """
+
+    if lock:
+        db.session.execute(
+            select(Course.course_id)
+            .filter(Course.course_id == course_id)
+            .with_for_update()
+        )
+
+    return db.session.execute(
+        select(func.coalesce(func.sum(Attachment.file_size), 0)).filter(
+            Attachment.course_id == course_id
+        )
+    ).scalar_one()
+
+
+def get_upload_max_size(course_id: uuid.UUID) -> int:
+    """Largest file the course attachments still have room for."""
+
+    quota_left = app.config.get(
+        "ATTACHMENT_COURSE_QUOTA", 0
+    ) - get_course_attachments_size(course_id)
+
+    return max(0, min(app.config.get("ATTACHMENT_MAX_SIZE", 0), quota_left))
+
+
+def parse_upload(
+    store: AttachmentStore, max_size: int
+) -> tuple[CombinedMultiDict, list[UploadFile]]:
+    """Parse the multipart request, streaming its files into the store.
+
+    Files are written chunk by chunk to the store temporary files instead of
+    being spooled, the caller discards the returned uploads once done.
+    """
+
+    if (request.content_length or 0) > max_size + UPLOAD_FORM_OVERHEAD:
+        raise AttachmentQuotaError(
+            f"Files are limited to {_format_size(max_size)} here."
+        )
+
+    uploads: list[UploadFile] = []
+
+    def stream_factory(*_args, **_kwargs) -> UploadFile:
+        upload = UploadFile(
+            store.make_temp_file(),
+            max_size - sum(upload.size for upload in uploads),
+        )
+        uploads.append(upload)
+        return upload
+
+    try:
+        _stream, form, files = parse_form_data(
+            request.environ,
+            stream_factory=stream_factory,
+            max_form_memory_size=app.config.get("MAX_FORM_MEMORY_SIZE"),
+            max_content_length=app.config.get("MAX_CONTENT_LENGTH"),
+        )
+    except Exception:
+        for upload in uploads:
+            upload.discard()
+        raise
+
+    return CombinedMultiDict([files, form]), uploads
+
+
+def add_attachment(
+    store: AttachmentStore,
+    course_id: uuid.UUID,
+    name: str,
+    filename: str,
+    upload: UploadFile,
+) -> Attachment:
+    """Add the uploaded file to the course attachments, the caller commits."""
+
+    upload.close()
+
+    quota = app.config.get("ATTACHMENT_COURSE_QUOTA", 0)
+    if get_course_attachments_size(course_id, lock=True) + upload.size > quota:
+        raise AttachmentQuotaError(
+            f"Course attachments are limited to {_format_size(quota)}."
+        )
+
+    attachment = Attachment(
+        attachment_id=uuid.uuid4(),
+        course_id=course_id,
+        name=name,
+        old_filename=filename,
+        new_filename=secure_filename(filename) or upload.file_hash,
+        file_path=store.get_location(upload.file_hash),
+        file_size=upload.size,
+        file_hash=upload.file_hash,
+        storage=store.name,
+    )
+    db.session.add(attachment)
+
+    reserve_blob(upload.file_hash, upload.size)
+
+    # Flushed first, locking the blob row until the file is saved.
+    db.session.flush()
+    store.save(upload.file_hash, upload.name)
+
+    return attachment
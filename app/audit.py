@@ -0,0 +1,495 @@
+import base64
+import fcntl
+import glob
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import date, datetime
+
+from flask import current_app as app
+from sqlalchemy import insert, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from . import db
+from .models import AuditLog, User
+
+SYNC_MODE = "sync"
+ASYNC_MODE = "async"
+
+INSERT_BATCH_SIZE = 1000
+
+PARTITION_NAME_FORMAT = "audit_logs_y%Ym%m"
+DEFAULT_PARTITION_NAME = "audit_logs_default"
+
+_lock = threading.Lock()
+_writer: "AuditWriter | None" = None
+
+_metrics = {
+    "enqueued": 0,
+    "written": 0,
+    "dropped": 0,
+    "failed": 0,
+    "recovered": 0,
+    "lag_seconds": 0.0,
+}
+
+
+def _add_metric(name: str, value) -> None:
+    with _lock:
+        _metrics[name] += value
+
+
+def write_entries(connection, entries: list[dict]) -> None:
+    """Write audit entries with multi-row inserts on the connection."""
+
+    for i in range(0, len(entries), INSERT_BATCH_SIZE):
+        connection.execute(insert(AuditLog).values(entries[i : i + INSERT_BATCH_SIZE]))
+
+
+def _write_entries_idempotent(connection, entries: list[dict]) -> None:
+    # Entries carry their own primary key, so replaying them is harmless.
+    for i in range(0, len(entries), INSERT_BATCH_SIZE):
+        connection.execute(
+            pg_insert(AuditLog)
+            .values(entries[i : i + INSERT_BATCH_SIZE])
+            .on_conflict_do_nothing(index_elements=["audit_log_id", "timestamp"])
+        )
+
+
+def _dump_entry(entry: dict) -> str:
+    return json.dumps(
+        {
+            **entry,
+            "audit_log_id": str(entry["audit_log_id"]),
+            "user_id": str(entry["user_id"]),
+            "timestamp": entry["timestamp"].isoformat(),
+        }
+    )
+
+
+def _load_entry(line: str) -> dict:
+    entry = json.loads(line)
+    entry["audit_log_id"] = uuid.UUID(entry["audit_log_id"])
+    entry["user_id"] = uuid.UUID(entry["user_id"])
+    entry["timestamp"] = datetime.fromisoformat(entry["timestamp"])
+    return entry
+
+
+class AuditWriter:
+    """Background writer draining audit entries into the database.
+
+    Entries are appended to a spool segment owned (flock-ed) by this worker
+    before they are queued. Once the queue is drained the segment is
+    truncated, unless some of its entries were dropped or failed to be
+    written, then it is rotated out and replayed by `recover_spool` of any
+    worker, which also picks up segments left behind by dead workers.
+    """
+
+    def __init__(self, engine, config) -> None:
+        self.engine = engine
+        self.pid = os.getpid()
+        self.spool_dir = config.get("AUDIT_SPOOL_DIR") or os.path.join(
+            app.instance_path, "audit-spool"
+        )
+        self.batch_size = config.get("AUDIT_BATCH_SIZE", 500)
+        self.flush_interval = config.get("AUDIT_FLUSH_INTERVAL", 1.0)
+        self.recovery_interval = config.get("AUDIT_SPOOL_RECOVERY_INTERVAL", 60)
+        self.fsync = config.get("AUDIT_SPOOL_FSYNC", False)
+        self.logger = app.logger
+
+        self.queue: queue.Queue = queue.Queue(
+            maxsize=config.get("AUDIT_QUEUE_SIZE", 10_000)
+        )
+        self.depth = 0
+        self.spool_lock = threading.Lock()
+        self.spool = None
+        self.spool_dirty = False
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._open_spool()
+
+        self.thread = threading.Thread(
+            target=self._run, name="audit-writer", daemon=True
+        )
+        self.thread.start()
+
+    def _open_spool(self) -> None:
+        path = os.path.join(self.spool_dir, f"audit-{self.pid}-{time.time_ns()}.jsonl")
+        self.spool = open(path, "a", encoding="utf-8")
+        fcntl.flock(self.spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.spool_dirty = False
+
+    def _release_spool(self) -> None:
+        """Rotate the drained spool out, keeping its file if still needed."""
+
+        with self.spool_lock:
+            if not self.queue.empty() or self.spool.tell() == 0:
+                return
+
+            if self.spool_dirty:
+                self.spool.close()
+                self._open_spool()
+            else:
+                self.spool.truncate(0)
+                self.spool.seek(0)
+
+    def enqueue(self, entries: list[dict]) -> None:
+        with self.spool_lock:
+            self.spool.write("".join(_dump_entry(e) + "\n" for e in entries))
+            self.spool.flush()
+            if self.fsync:
+                os.fsync(self.spool.fileno())
+
+            try:
+                self.queue.put_nowait((time.monotonic(), entries))
+                with _lock:
+                    self.depth += len(entries)
+                    _metrics["enqueued"] += len(entries)
+            except queue.Full:
+                # Still on the spool, the recovery will write them later.
+                self.spool_dirty = True
+                _add_metric("dropped", len(entries))
+
+    def _take_batch(self) -> list[tuple[float, list[dict]]]:
+        batch = []
+        size = 0
+        try:
+            item = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return batch
+
+        while True:
+            batch.append(item)
+            size += len(item[1])
+            if size >= self.batch_size:
+                break
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self) -> None:
+        last_recovery = 0.0
+
+        while True:
+            if time.monotonic() - last_recovery > self.recovery_interval:
+                last_recovery = time.monotonic()
+                self.recover_spool()
+
+            batch = self._take_batch()
+            if batch:
+                entries = [entry for _, items in batch for entry in items]
+                try:
+                    with self.engine.begin() as connection:
+                        write_entries(connection, entries)
+                    _add_metric("written", len(entries))
+                except Exception as e:
+                    self.logger.error(f"Audit writer failed: {e}")
+                    _add_metric("failed", len(entries))
+                    with self.spool_lock:
+                        self.spool_dirty = True
+                    time.sleep(self.flush_interval)
+
+                with _lock:
+                    self.depth -= len(entries)
+                    _metrics["lag_seconds"] = time.monotonic() - batch[0][0]
+
+            self._release_spool()
+
+    def recover_spool(self) -> None:
+        """Replay spool segments that are not owned by a running writer."""
+
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, "audit-*.jsonl"))):
+            if path == self.spool.name:
+                continue
+
+            try:
+                with open(path, encoding="utf-8") as segment:
+                    try:
+                        fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+
+                    entries = [_load_entry(line) for line in segment if line.strip()]
+                    if entries:
+                        with self.engine.begin() as connection:
+                            _write_entries_idempotent(connection, entries)
+                    os.remove(path)
+                    _add_metric("recovered", len(entries))
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                self.logger.error(f"Audit spool recovery of {path} failed: {e}")
+
+
+def get_writer() -> AuditWriter:
+    global _writer
+
+    # Started lazily, and again in each forked worker.
+    if _writer is None or _writer.pid != os.getpid():
+        with _lock:
+            if _writer is None or _writer.pid != os.getpid():
+                _writer = AuditWriter(db.engine, app.config)
+
+    return _writer
+
+
+def is_async() -> bool:
+    return app.config.get("AUDIT_LOG_MODE", SYNC_MODE) == ASYNC_MODE
+
+
+def enqueue_entries(entries: list[dict]) -> None:
+    """Hand committed audit entries to the background writer."""
+
+    get_writer().enqueue(entries)
+
+
+def get_metrics() -> dict:
+    """Snapshot of the audit pipeline metrics of this worker."""
+
+    with _lock:
+        metrics = dict(_metrics)
+
+    metrics["mode"] = app.config.get("AUDIT_LOG_MODE", SYNC_MODE)
+    metrics["queue_depth"] = _writer.depth if _writer else 0
+
+    return metrics
+
+
+# Monthly partitions of `audit_logs`
+
+
+def _add_months(month: date, months: int) -> date:
+    years, month_index = divmod(month.month - 1 + months, 12)
+    return date(month.year + years, month_index + 1, 1)
+
+
+def get_partition_name(month: date) -> str:
+    return month.strftime(PARTITION_NAME_FORMAT)
+
+
+def _list_partition_names(connection) -> list[str]:
+    return list(
+        connection.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE parent.relname = :parent"
+            ),
+            {"parent": AuditLog.__tablename__},
+        ).scalars()
+    )
+
+
+def list_partitions(connection) -> list[tuple[str, date]]:
+    """List monthly partitions of `audit_logs` with their first day, oldest first."""
+
+    partitions = []
+    for name in _list_partition_names(connection):
+        try:
+            month = datetime.strptime(name, PARTITION_NAME_FORMAT).date()
+        except ValueError:
+            continue
+        partitions.append((name, month))
+
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def ensure_partitions(connection, months_ahead: int = 3) -> list[str]:
+    """Create the partitions of the current and the coming months.
+
+    Months with rows in the default partition get their partition as well.
+    Postgres refuses to create a partition overlapping rows of the default
+    one, so it is detached while their rows are moved to the new partitions.
+    """
+
+    current_month = date.today().replace(day=1)
+    months = {_add_months(current_month, i) for i in range(months_ahead + 1)}
+
+    has_default = DEFAULT_PARTITION_NAME in _list_partition_names(connection)
+    if has_default:
+        months.update(
+            connection.execute(
+                text(
+                    "SELECT DISTINCT CAST(date_trunc('month', timestamp) AS date) "
+                    f"FROM {DEFAULT_PARTITION_NAME}"
+                )
+            ).scalars()
+        )
+
+    existing = {name for name, _ in list_partitions(connection)}
+    missing = [
+        month for month in sorted(months) if get_partition_name(month) not in existing
+    ]
+    if not missing:
+        return []
+
+    if has_default:
+        connection.execute(
+            text(f"ALTER TABLE audit_logs DETACH PARTITION {DEFAULT_PARTITION_NAME}")
+        )
+
+    created = []
+    for month in missing:
+        name = get_partition_name(month)
+        next_month = _add_months(month, 1)
+
+        connection.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF audit_logs "
+                f"FOR VALUES FROM ('{month}') TO ('{next_month}')"
+            )
+        )
+        if has_default:
+            connection.execute(
+                text(
+                    f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION_NAME} "
+                    "WHERE timestamp >= :start AND timestamp < :end RETURNING *) "
+                    f"INSERT INTO {name} SELECT * FROM moved"
+                ),
+                {"start": month, "end": next_month},
+            )
+        created.append(name)
+
+    if has_default:
+        connection.execute(
+            text(
+                f"ALTER TABLE audit_logs ATTACH PARTITION {DEFAULT_PARTITION_NAME} "
+                "DEFAULT"
+            )
+        )
+
+    return created
+
+
+def export_partition(connection, name: str, archive_dir: str) -> str:
+    """Stream the partition rows into a gzip-compressed JSON Lines file."""
+
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.jsonl.gz")
+    tmp_path = f"{path}.tmp"
+
+    result = connection.execution_options(stream_results=True).execute(
+        text(f"SELECT * FROM {name} ORDER BY timestamp")
+    )
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as archive:
+        for row in result.mappings():
+            archive.write(json.dumps(dict(row), default=str) + "\n")
+
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def apply_retention(engine, keep_months: int, archive_dir: str) -> list[str]:
+    """Archive and drop the partitions older than `keep_months` months.
+
+    Each partition is exported before it is detached and dropped, so a
+    failed export leaves it attached and untouched.
+    """
+
+    cutoff = _add_months(date.today().replace(day=1), -keep_months)
+
+    # Move the rows of the default partition to their monthly partitions,
+    # so the old ones are archived and dropped along with the others.
+    with engine.begin() as connection:
+        ensure_partitions(connection)
+        partitions = list_partitions(connection)
+
+    archived = []
+    for name, month in partitions:
+        if _add_months(month, 1) > cutoff:
+            break
+
+        with engine.connect() as connection:
+            path = export_partition(connection, name, archive_dir)
+
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE audit_logs DETACH PARTITION {name}"))
+            connection.execute(text(f"DROP TABLE {name}"))
+
+        archived.append(path)
+
+    return archived
+
+
+# Audit log browsing
+
+
+def encode_cursor(timestamp: datetime, audit_log_id: uuid.UUID) -> str:
+    value = f"{timestamp.isoformat()},{audit_log_id}"
+    return base64.urlsafe_b64encode(value.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        timestamp, audit_log_id = value.split(",")
+        return datetime.fromisoformat(timestamp), uuid.UUID(audit_log_id)
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+
+def query_audit_logs(
+    user_id: uuid.UUID | None = None,
+    table_name: str | None = None,
+    object_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: str | None = None,
+    limit: int = 50,
+) -> tuple[list, str | None]:
+    """Get a page of audit logs, newest first, and the cursor of the next page.
+
+    Pages are keyset paginated on (timestamp, audit_log_id), so every filter
+    combination is served by one of the matching composite indexes, and any
+    page costs the same regardless of its depth.
+    """
+
+    stmt = select(
+        AuditLog.audit_log_id,
+        AuditLog.timestamp,
+        AuditLog.user_id,
+        User.username,
+        AuditLog.table_name,
+        AuditLog.object_id,
+        AuditLog.flag,
+        AuditLog.changed_data,
+        AuditLog.justification,
+    ).join(User, User.user_id == AuditLog.user_id)
+
+    if user_id:
+        stmt = stmt.filter(AuditLog.user_id == user_id)
+    if table_name:
+        stmt = stmt.filter(AuditLog.table_name == table_name)
+    if object_id:
+        stmt = stmt.filter(AuditLog.object_id == object_id)
+    if since:
+        stmt = stmt.filter(AuditLog.timestamp >= since)
+    if until:
+        stmt = stmt.filter(AuditLog.timestamp < until)
+    if cursor:
+        stmt = stmt.filter(
+            tuple_(AuditLog.timestamp, AuditLog.audit_log_id)
+            < tuple_(*decode_cursor(cursor))
+        )
+
+    stmt = stmt.order_by(AuditLog.timestamp.desc(), AuditLog.audit_log_id.desc()).limit(
+        limit + 1
+    )
+
+    rows = db.session.execute(stmt).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].audit_log_id)
+
+    return rows, next_cursor
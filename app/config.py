@@ -12,6 +12,8 @@ class Config:
     DEBUG = False
     TESTING = False
 
+    ENVIRONMENT = os.getenv("ENVIRONMENT", "local")
+
     SECRET_KEY = os.getenv("SECRET_KEY")
 
     SUPERUSER_GROUP_NAME = os.getenv("SUPERUSER_GROUP_NAME")
@@ -24,6 +26,69 @@ class Config:
 
     DEFAULT_USER_PASSWORD = os.getenv("DEFAULT_USER_PASSWORD")
 
+    BCRYPT_LOG_ROUNDS = int(os.getenv("BCRYPT_LOG_ROUNDS", 12))
+    # Per gunicorn worker, keep workers + queue size below the worker threads
+    # so logins are rejected before they take every thread of the worker.
+    PASSWORD_HASHING_WORKERS = int(os.getenv("PASSWORD_HASHING_WORKERS", 2))
+    PASSWORD_HASHING_QUEUE_SIZE = int(os.getenv("PASSWORD_HASHING_QUEUE_SIZE", 4))
+    PASSWORD_HASHING_TIMEOUT = float(os.getenv("PASSWORD_HASHING_TIMEOUT", 10))
+
+    USER_IMPORT_CHUNK_SIZE = int(os.getenv("USER_IMPORT_CHUNK_SIZE", 1000))
+    # Imports from the admin panel, larger ones go through the cli command,
+    # which hashes on every core.
+    USER_IMPORT_HASHING_WORKERS = int(os.getenv("USER_IMPORT_HASHING_WORKERS", 2))
+    USER_IMPORT_MAX_ROWS = int(os.getenv("USER_IMPORT_MAX_ROWS", 5000))
+
+    # Number of proxies in front of the app trusted for X-Forwarded-For.
+    PROXY_FIX_X_FOR = int(os.getenv("PROXY_FIX_X_FOR", 1))
+
+    LOGIN_THROTTLE_ENABLED = os.getenv("LOGIN_THROTTLE_ENABLED", "true") == "true"
+    LOGIN_THROTTLE_IP_BURST = int(os.getenv("LOGIN_THROTTLE_IP_BURST", 30))
+    LOGIN_THROTTLE_IP_PER_MINUTE = int(os.getenv("LOGIN_THROTTLE_IP_PER_MINUTE", 30))
+    LOGIN_THROTTLE_USERNAME_BURST = int(os.getenv("LOGIN_THROTTLE_USERNAME_BURST", 5))
+    LOGIN_THROTTLE_USERNAME_PER_MINUTE = int(
+        os.getenv("LOGIN_THROTTLE_USERNAME_PER_MINUTE", 5)
+    )
+    LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", 100_000))
+
+    # "sync" writes audit logs in the request transaction, "async" hands
+    # them to a background writer backed by a local spool.
+    AUDIT_LOG_MODE = os.getenv("AUDIT_LOG_MODE", "sync")
+    AUDIT_SPOOL_DIR = os.getenv("AUDIT_SPOOL_DIR")
+    AUDIT_SPOOL_FSYNC = os.getenv("AUDIT_SPOOL_FSYNC", "false") == "true"
+    AUDIT_SPOOL_RECOVERY_INTERVAL = int(os.getenv("AUDIT_SPOOL_RECOVERY_INTERVAL", 60))
+    AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", 10_000))
+    AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", 500))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", 1.0))
+    AUDIT_RETENTION_MONTHS = int(os.getenv("AUDIT_RETENTION_MONTHS", 12))
+    AUDIT_ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR")
+    AUDIT_LOG_PAGE_SIZE = int(os.getenv("AUDIT_LOG_PAGE_SIZE", 50))
+
+    SEARCH_RESULT_LIMIT = int(os.getenv("SEARCH_RESULT_LIMIT", 50))
+
+    FRAGMENT_CACHE_STORE = os.getenv("FRAGMENT_CACHE_STORE", "memory")
+    FRAGMENT_CACHE_TIMEOUT = int(os.getenv("FRAGMENT_CACHE_TIMEOUT", 300))
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.getenv("FRAGMENT_CACHE_MAX_ENTRIES", 10_000))
+
+    PROGRESS_FLUSH_INTERVAL = float(os.getenv("PROGRESS_FLUSH_INTERVAL", 5.0))
+    PROGRESS_BATCH_SIZE = int(os.getenv("PROGRESS_BATCH_SIZE", 1000))
+    PROGRESS_BUFFER_MAX_KEYS = int(os.getenv("PROGRESS_BUFFER_MAX_KEYS", 50_000))
+    # Longest gap between lesson events counted as learning, heartbeats are
+    # sent every 30 seconds while the lesson is visible.
+    PROGRESS_MAX_GAP = float(os.getenv("PROGRESS_MAX_GAP", 60.0))
+
+    ATTACHMENT_CHUNK_SIZE = int(os.getenv("ATTACHMENT_CHUNK_SIZE", 1024 * 1024))
+    # "local" keeps the attachment files under ATTACHMENT_STORE_DIR, served
+    # by nginx from ATTACHMENT_ACCEL_REDIRECT_PREFIX when set. The directory
+    # must be set outside of the local environment.
+    ATTACHMENT_STORE = os.getenv("ATTACHMENT_STORE", "local")
+    ATTACHMENT_STORE_DIR = os.getenv("ATTACHMENT_STORE_DIR")
+    ATTACHMENT_ACCEL_REDIRECT_PREFIX = os.getenv("ATTACHMENT_ACCEL_REDIRECT_PREFIX")
+    ATTACHMENT_MAX_SIZE = int(os.getenv("ATTACHMENT_MAX_SIZE", 1024 * 1024 * 1024))
+    ATTACHMENT_COURSE_QUOTA = int(
+        os.getenv("ATTACHMENT_COURSE_QUOTA", 5 * 1024 * 1024 * 1024)
+    )
+
     POSTGRES_USER = os.getenv("POSTGRES_USER")
     POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
     POSTGRES_HOST = os.getenv("POSTGRES_HOST")
@@ -0,0 +1,146 @@
+import threading
+import uuid
+
+from sqlalchemy import func, select, update
+
+from . import db
+from .fragment_cache import bump_data_versions, get_course_scope, get_data_versions
+from .models import Course, CourseLesson, Lesson, UserCourse
+
+# Data version of the course counters, which change through Core updates
+# that no mapper event sees.
+COUNTERS_DATA_VERSION = "course_counters"
+
+# Per worker outlines by course id, stamped with the course data version.
+_lock = threading.Lock()
+_outlines: dict[uuid.UUID, tuple[int, "CourseOutline"]] = {}
+
+
+def update_course_counters(connection, course_id: uuid.UUID, **deltas) -> None:
+    """Add the deltas to the course counters in a single atomic update."""
+
+    connection.execute(
+        update(Course)
+        .filter(Course.course_id == course_id)
+        .values(
+            {
+                column: getattr(Course, column) + delta
+                for column, delta in deltas.items()
+            }
+        )
+    )
+    bump_data_versions(connection, {COUNTERS_DATA_VERSION})
+
+
+def rebuild_course_counters(connection) -> None:
+    """Recompute the course counters from the enrollments and lessons."""
+
+    enrolled_count = (
+        select(func.count())
+        .select_from(UserCourse)
+        .filter(UserCourse.course_id == Course.course_id)
+        .scalar_subquery()
+    )
+    lessons_count = (
+        select(func.count())
+        .select_from(CourseLesson)
+        .filter(CourseLesson.course_id == Course.course_id)
+        .scalar_subquery()
+    )
+
+    connection.execute(
+        update(Course).values(
+            enrolled_count=enrolled_count, lessons_count=lessons_count
+        )
+    )
+    bump_data_versions(connection, {COUNTERS_DATA_VERSION})
+
+
+class CourseOutline:
+    """Course name and its ordered (lesson_id, name) pairs."""
+
+    __slots__ = ("course_id", "name", "lessons")
+
+    def __init__(
+        self, course_id: uuid.UUID, name: str, lessons: list[tuple[uuid.UUID, str]]
+    ):
+        self.course_id = course_id
+        self.name = name
+        self.lessons = tuple(lessons)
+
+    def __len__(self) -> int:
+        return len(self.lessons)
+
+    def __iter__(self):
+        return iter(self.lessons)
+
+    def __contains__(self, lesson_id: uuid.UUID) -> bool:
+        return self.position(lesson_id) is not None
+
+    def position(self, lesson_id: uuid.UUID) -> int | None:
+        for position, (outline_lesson_id, _name) in enumerate(self.lessons):
+            if outline_lesson_id == lesson_id:
+                return position
+        return None
+
+    def previous_lesson(self, lesson_id: uuid.UUID) -> tuple[uuid.UUID, str] | None:
+        position = self.position(lesson_id)
+        if not position:
+            return None
+        return self.lessons[position - 1]
+
+    def next_lesson(self, lesson_id: uuid.UUID) -> tuple[uuid.UUID, str] | None:
+        position = self.position(lesson_id)
+        if position is None or position + 1 >= len(self.lessons):
+            return None
+        return self.lessons[position + 1]
+
+
+def load_course_outline(course_id: uuid.UUID) -> CourseOutline | None:
+    """Load the course outline in a single query."""
+
+    rows = db.session.execute(
+        select(Course.name, Lesson.lesson_id, Lesson.name.label("lesson_name"))
+        .select_from(Course)
+        .outerjoin(CourseLesson, CourseLesson.course_id == Course.course_id)
+        .outerjoin(Lesson, Lesson.lesson_id == CourseLesson.lesson_id)
+        .filter(Course.course_id == course_id)
+        .order_by(CourseLesson.index, CourseLesson.assigned_at)
+    ).all()
+
+    if not rows:
+        return None
+
+    return CourseOutline(
+        course_id,
+        rows[0].name,
+        [(row.lesson_id, row.lesson_name) for row in rows if row.lesson_id],
+    )
+
+
+def get_course_outline(course_id: uuid.UUID) -> CourseOutline | None:
+    """Get the course outline, cached until the course or its lessons change."""
+
+    scope = get_course_scope(course_id)
+    version = get_data_versions([scope])[scope]
+
+    cached = _outlines.get(course_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    outline = load_course_outline(course_id)
+    if outline is not None:
+        with _lock:
+            _outlines[course_id] = (version, outline)
+
+    return outline
+
+
+def invalidate_course_outline(course_id: uuid.UUID) -> None:
+    """Drop the cached course outline of this worker.
+
+    Other workers drop theirs once they see the bumped data version.
+    """
+
+    with _lock:
+        _outlines.pop(course_id, None)
@@ -2,10 +2,8 @@ from functools import wraps
 
 from flask import flash, redirect, url_for
 from flask_login import current_user
-from sqlalchemy import select
 
-from . import db
-from .models import Permission, UserPermission
+from .permissions import has_permission
 
 
 def superuser_required(f):
@@ -49,19 +47,7 @@ def permission_required(permission_codename: str):
             if current_user.is_superuser:
                 return f(*args, **kwargs)
 
-            permission = db.session.execute(
-                select(Permission).filter(Permission.codename == permission_codename)
-            ).scalar_one_or_none()
-
-            if not permission:
-                flash("Page you attempt to visit does not exist", "warning")
-                return redirect(url_for("base.home"))
-
-            user_permission = db.session.get(
-                UserPermission, ident=(current_user.user_id, permission.permission_id)
-            )
-
-            if not user_permission:
+            if not has_permission(current_user, permission_codename):
                 flash("Page you attempt to visit does not exist", "warning")
                 return redirect(url_for("base.home"))
             return f(*args, **kwargs)
@@ -1,23 +1,63 @@
 import uuid
+from datetime import date, datetime
 
 from flask_login import current_user
-from sqlalchemy import event, insert
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import object_session
 
-from . import utils
+from . import (
+    attachments,
+    audit,
+    courses,
+    db,
+    fragment_cache,
+    learning_stats,
+    permissions,
+    utils,
+)
 from .models import (
     Assessment,
     AssessmentQuestion,
-    AuditLog,
+    Attachment,
     Choice,
     Course,
     CourseAssessment,
     CourseLesson,
+    Group,
+    GroupPermission,
     Lesson,
     Question,
+    User,
     UserAssessment,
     UserAssessmentQuestion,
     UserCourse,
+    UserCourseLesson,
+    UserPermission,
+)
+
+AUDIT_ENTRIES_KEY = "audit_entries"
+AUDIT_PENDING_ENTRIES_KEY = "audit_pending_entries"
+DATA_VERSIONS_KEY = "data_versions"
+
+# Never store the values of these columns in the audit log.
+AUDIT_MASKED_COLUMNS = {"password_hash"}
+
+AUDITED_MODELS = (
+    User,
+    Group,
+    GroupPermission,
     UserPermission,
+    Course,
+    CourseLesson,
+    UserCourse,
+    CourseAssessment,
+    Assessment,
+    UserAssessment,
+    Lesson,
+    UserAssessmentQuestion,
+    AssessmentQuestion,
+    Question,
+    Choice,
 )
 
 
@@ -33,60 +73,391 @@ def get_target_id_str(target) -> str:
     return target_id_str
 
 
-def after_insert_listener(mapper, connection, target):
-    """Hook to run after each insert statement."""
-    _mapper = mapper
+def get_json_value(key: str, value):
+    if key in AUDIT_MASKED_COLUMNS:
+        return "***"
+    if isinstance(value, (uuid.UUID, datetime, date)):
+        return str(value)
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    return value
+
+
+def get_changed_columns(target) -> set[str]:
+    """Get the names of the changed columns of the target."""
+
+    state = inspect(target)
+    return {
+        attr.key
+        for attr in state.mapper.column_attrs
+        if state.attrs[attr.key].history.has_changes()
+    }
+
+
+def get_changed_data(target) -> dict:
+    """Get changed columns of the target as {"column": [old, new]}."""
+
+    state = inspect(target)
+    changed_data = {}
+
+    for attr in state.mapper.column_attrs:
+        history = state.attrs[attr.key].history
+        if not history.has_changes():
+            continue
+
+        old_value = history.deleted[0] if history.deleted else None
+        new_value = history.added[0] if history.added else None
+        changed_data[attr.key] = [
+            get_json_value(attr.key, old_value),
+            get_json_value(attr.key, new_value),
+        ]
+
+    return changed_data
+
+
+def add_audit_entry(target, flag: int, changed_data: dict | None) -> None:
+    """Collect an audit entry, to be written once the session flush ends."""
 
     if not (current_user and current_user.is_authenticated):
         return
 
-    connection.execute(
-        insert(AuditLog).values(
-            user_id=current_user.user_id,
-            object_id=get_target_id_str(target),
-            table_name=target.__tablename__,
-            flag=utils.INSERT_FLAG,
-            changed_data="{}",
-        )
+    session = object_session(target)
+    session.info.setdefault(AUDIT_ENTRIES_KEY, []).append(
+        {
+            "audit_log_id": uuid.uuid4(),
+            "user_id": current_user.user_id,
+            "timestamp": datetime.now(),
+            "object_id": get_target_id_str(target),
+            "table_name": target.__tablename__,
+            "flag": flag,
+            "changed_data": changed_data,
+        }
     )
 
 
+def after_insert_listener(mapper, connection, target):
+    """Hook to run after each insert statement."""
+    _mapper = mapper
+    _connection = connection
+
+    add_audit_entry(target, utils.INSERT_FLAG, None)
+
+
 def after_update_listener(mapper, connection, target):
     """Hook to run after each update statement."""
     _mapper = mapper
+    _connection = connection
 
-    if not (current_user and current_user.is_authenticated):
+    changed_data = get_changed_data(target)
+    if not changed_data:
         return
 
-    connection.execute(
-        insert(AuditLog).values(
-            user_id=current_user.user_id,
-            object_id=get_target_id_str(target),
-            table_name=target.__tablename__,
-            flag=utils.UPDATE_FLAG,
-            changed_data=str({"change": {}}),
-        )
+    add_audit_entry(target, utils.UPDATE_FLAG, changed_data)
+
+
+def after_flush_listener(session, flush_context):
+    """Hook to write the audit entries collected during the flush."""
+    _flush_context = flush_context
+
+    entries = session.info.pop(AUDIT_ENTRIES_KEY, None)
+    if not entries:
+        return
+
+    if audit.is_async():
+        # Handed to the audit writer only once the transaction commits.
+        session.info.setdefault(AUDIT_PENDING_ENTRIES_KEY, []).extend(entries)
+        return
+
+    audit.write_entries(session.connection(), entries)
+
+
+def after_commit_listener(session):
+    """Hook to hand the committed audit entries to the audit writer."""
+
+    entries = session.info.pop(AUDIT_PENDING_ENTRIES_KEY, None)
+    if entries:
+        audit.enqueue_entries(entries)
+
+
+def after_soft_rollback_listener(session, previous_transaction):
+    """Hook to drop audit entries of a transaction that did not complete."""
+    _previous_transaction = previous_transaction
+
+    session.info.pop(AUDIT_ENTRIES_KEY, None)
+    session.info.pop(AUDIT_PENDING_ENTRIES_KEY, None)
+    session.info.pop(DATA_VERSIONS_KEY, None)
+
+
+def after_user_permission_insert_listener(mapper, connection, target):
+    """Hook to materialize a user permission grant."""
+    _mapper = mapper
+
+    permissions.grant_user_permission(connection, target.user_id, target.permission_id)
+
+
+def after_user_permission_delete_listener(mapper, connection, target):
+    """Hook to clear a user permission grant."""
+    _mapper = mapper
+
+    permissions.revoke_user_permission(connection, target.user_id, target.permission_id)
+
+
+def after_group_permission_insert_listener(mapper, connection, target):
+    """Hook to materialize a group permission grant for the group members."""
+    _mapper = mapper
+
+    permissions.grant_group_permission(
+        connection, target.group_id, target.permission_id
+    )
+
+
+def after_group_permission_delete_listener(mapper, connection, target):
+    """Hook to clear a group permission grant from the group members."""
+    _mapper = mapper
+
+    permissions.revoke_group_permission(
+        connection, target.group_id, target.permission_id
+    )
+
+
+def after_user_group_change_listener(mapper, connection, target):
+    """Hook to move user group grants along with his/her group."""
+    _mapper = mapper
+
+    if not inspect(target).attrs.group_id.history.has_changes():
+        return
+
+    permissions.sync_user_group_permissions(connection, target.user_id, target.group_id)
+
+
+# Rollup deltas of the user learning stats, by source model.
+LEARNING_STATS_DELTAS = {
+    UserCourse: learning_stats.user_course_deltas,
+    UserAssessment: learning_stats.user_assessment_deltas,
+    UserCourseLesson: learning_stats.user_course_lesson_deltas,
+}
+
+
+def update_learning_stats(mapper, connection, target, change: int) -> None:
+    deltas = LEARNING_STATS_DELTAS[mapper.class_](target, change)
+    learning_stats.update_user_learning_stats(connection, target.user_id, **deltas)
+
+
+def after_learning_insert_listener(mapper, connection, target):
+    """Hook to add a new learning row to the user learning stats."""
+
+    update_learning_stats(mapper, connection, target, 1)
+
+
+def after_learning_update_listener(mapper, connection, target):
+    """Hook to apply a learning row change to the user learning stats."""
+
+    update_learning_stats(mapper, connection, target, 0)
+
+
+def after_learning_delete_listener(mapper, connection, target):
+    """Hook to remove a learning row from the user learning stats."""
+
+    update_learning_stats(mapper, connection, target, -1)
+
+
+def after_learning_activity_listener(mapper, connection, target):
+    """Hook to mark the user activity days, and update his/her streaks."""
+    _mapper = mapper
+
+    learning_stats.record_user_activity(
+        connection, target.user_id, learning_stats.get_activity_days(target)
     )
 
 
+def after_user_course_insert_listener(mapper, connection, target):
+    """Hook to count a new course enrollment."""
+    _mapper = mapper
+
+    courses.update_course_counters(connection, target.course_id, enrolled_count=1)
+
+
+def after_user_course_delete_listener(mapper, connection, target):
+    """Hook to discount a removed course enrollment."""
+    _mapper = mapper
+
+    courses.update_course_counters(connection, target.course_id, enrolled_count=-1)
+
+
+def after_course_lesson_insert_listener(mapper, connection, target):
+    """Hook to count a new course lesson."""
+    _mapper = mapper
+
+    courses.update_course_counters(connection, target.course_id, lessons_count=1)
+
+
+def after_course_lesson_delete_listener(mapper, connection, target):
+    """Hook to discount a removed course lesson."""
+    _mapper = mapper
+
+    courses.update_course_counters(connection, target.course_id, lessons_count=-1)
+
+
+def after_attachment_insert_listener(mapper, connection, target):
+    """Hook to reference the blob of a new attachment held by a store."""
+    _mapper = mapper
+
+    if target.storage != attachments.DATABASE_STORAGE:
+        attachments.update_blob_refs(connection, target.file_hash, target.file_size, 1)
+
+
+def after_attachment_update_listener(mapper, connection, target):
+    """Hook to reference the blob of an attachment moved into a store."""
+    _mapper = mapper
+
+    history = inspect(target).attrs.storage.history
+    if history.deleted == [attachments.DATABASE_STORAGE] and history.added:
+        attachments.update_blob_refs(connection, target.file_hash, target.file_size, 1)
+
+
+def after_attachment_delete_listener(mapper, connection, target):
+    """Hook to dereference the blob of a removed attachment."""
+    _mapper = mapper
+
+    if target.storage != attachments.DATABASE_STORAGE:
+        attachments.update_blob_refs(connection, target.file_hash, target.file_size, -1)
+
+
+# Fragment cache data versions bumped by the model changes, `user` being
+# the data of the row user and `course` the data of the row course(s), which
+# stamps the course pages and outline. Enrollments only touch their user, the
+# course counters they change bump `courses.COUNTERS_DATA_VERSION`.
+DATA_VERSION_SCOPES = {
+    User: ("users", fragment_cache.USER_SCOPE),
+    Course: ("courses", fragment_cache.COURSE_SCOPE),
+    Lesson: ("courses", fragment_cache.COURSE_SCOPE),
+    CourseLesson: ("courses", fragment_cache.COURSE_SCOPE),
+    Assessment: ("courses",),
+    CourseAssessment: ("courses",),
+    Attachment: (fragment_cache.COURSE_SCOPE,),
+    UserCourse: (fragment_cache.USER_SCOPE,),
+    UserAssessment: (fragment_cache.USER_SCOPE,),
+    UserCourseLesson: (fragment_cache.USER_SCOPE,),
+}
+
+
+# Columns whose changes alone bump no data version. Course and lesson pages
+# are stamped with their content hash and no fragment shows the content, the
+# attachments moved into a store still render the same.
+CONTENT_COLUMNS = {"content", "content_html", "content_hash"}
+
+DATA_VERSION_SKIPPED_COLUMNS = {
+    Course: CONTENT_COLUMNS,
+    Lesson: CONTENT_COLUMNS,
+    Attachment: {"storage", "file_path", "file_data"},
+}
+
+
+def get_target_course_ids(connection, target) -> list[uuid.UUID]:
+    """Get the ids of the courses the target belongs to."""
+
+    if isinstance(target, Lesson):
+        return (
+            connection.execute(
+                select(CourseLesson.course_id).filter(
+                    CourseLesson.lesson_id == target.lesson_id
+                )
+            )
+            .scalars()
+            .all()
+        )
+
+    return [target.course_id]
+
+
+def after_data_change_listener(mapper, connection, target):
+    """Hook to collect the data versions to bump at the end of the flush."""
+
+    names = object_session(target).info.setdefault(DATA_VERSIONS_KEY, set())
+    for name in DATA_VERSION_SCOPES[mapper.class_]:
+        if name == fragment_cache.USER_SCOPE:
+            names.add(fragment_cache.get_user_scope(target.user_id))
+        elif name == fragment_cache.COURSE_SCOPE:
+            names.update(
+                fragment_cache.get_course_scope(course_id)
+                for course_id in get_target_course_ids(connection, target)
+            )
+        else:
+            names.add(name)
+
+
+def after_data_update_listener(mapper, connection, target):
+    """Hook to collect the data versions of an update, skipped columns aside."""
+
+    skipped = DATA_VERSION_SKIPPED_COLUMNS.get(mapper.class_, set())
+    if get_changed_columns(target) <= skipped:
+        return
+
+    after_data_change_listener(mapper, connection, target)
+
+
+def after_flush_data_versions_listener(session, flush_context):
+    """Hook to bump the data versions changed during the flush."""
+    _flush_context = flush_context
+
+    names = session.info.pop(DATA_VERSIONS_KEY, None)
+    if names:
+        fragment_cache.bump_data_versions(session.connection(), names)
+
+
 # register events
+def listen(target, identifier: str, fn) -> None:
+    """Register the event listener, unless it is already registered."""
+
+    if not event.contains(target, identifier, fn):
+        event.listen(target, identifier, fn)
+
+
 def register_sa_events() -> None:
     """Register SQLAlchemy Events"""
 
-    event.listen(UserPermission, "after_insert", after_insert_listener)
-    event.listen(Course, "after_insert", after_insert_listener)
-    event.listen(CourseLesson, "after_insert", after_insert_listener)
-    event.listen(UserCourse, "after_insert", after_insert_listener)
-    event.listen(CourseAssessment, "after_insert", after_insert_listener)
-    event.listen(Assessment, "after_insert", after_insert_listener)
-    event.listen(UserAssessment, "after_insert", after_insert_listener)
-    event.listen(Lesson, "after_insert", after_insert_listener)
-    event.listen(CourseLesson, "after_insert", after_insert_listener)
-    event.listen(UserAssessmentQuestion, "after_insert", after_insert_listener)
-    event.listen(AssessmentQuestion, "after_insert", after_insert_listener)
-    event.listen(Question, "after_insert", after_insert_listener)
-    event.listen(Choice, "after_insert", after_insert_listener)
-
-    # Register Update Events
-    # event.listen(User, "after_update", after_update_listener)
-    # event.listen(User, "after_insert", after_insert_listener)
+    # Register Audit Log Events
+    for model in AUDITED_MODELS:
+        listen(model, "after_insert", after_insert_listener)
+        listen(model, "after_update", after_update_listener)
+
+    listen(db.session, "after_flush", after_flush_listener)
+    listen(db.session, "after_commit", after_commit_listener)
+    listen(db.session, "after_soft_rollback", after_soft_rollback_listener)
+
+    # Register Effective Permissions Events
+    listen(UserPermission, "after_insert", after_user_permission_insert_listener)
+    listen(UserPermission, "after_delete", after_user_permission_delete_listener)
+    listen(GroupPermission, "after_insert", after_group_permission_insert_listener)
+    listen(GroupPermission, "after_delete", after_group_permission_delete_listener)
+    listen(User, "after_insert", after_user_group_change_listener)
+    listen(User, "after_update", after_user_group_change_listener)
+
+    # Register Learning Stats Events
+    for model in LEARNING_STATS_DELTAS:
+        listen(model, "after_insert", after_learning_insert_listener)
+        listen(model, "after_update", after_learning_update_listener)
+        listen(model, "after_delete", after_learning_delete_listener)
+
+    for model in learning_stats.ACTIVITY_COLUMNS:
+        listen(model, "after_insert", after_learning_activity_listener)
+        listen(model, "after_update", after_learning_activity_listener)
+
+    # Register Course Counters Events
+    listen(UserCourse, "after_insert", after_user_course_insert_listener)
+    listen(UserCourse, "after_delete", after_user_course_delete_listener)
+    listen(CourseLesson, "after_insert", after_course_lesson_insert_listener)
+    listen(CourseLesson, "after_delete", after_course_lesson_delete_listener)
+
+    # Register Attachment Blobs Events
+    listen(Attachment, "after_insert", after_attachment_insert_listener)
+    listen(Attachment, "after_update", after_attachment_update_listener)
+    listen(Attachment, "after_delete", after_attachment_delete_listener)
+
+    # Register Fragment Cache Events
+    for model in DATA_VERSION_SCOPES:
+        listen(model, "after_insert", after_data_change_listener)
+        listen(model, "after_update", after_data_update_listener)
+        listen(model, "after_delete", after_data_change_listener)
+
+    listen(db.session, "after_flush", after_flush_data_versions_listener)
@@ -0,0 +1,243 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import Flask
+from flask import current_app as app
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from werkzeug.utils import import_string
+
+from . import db
+from .models import DataVersion
+
+# Version scope resolved to the version of the current user data.
+USER_SCOPE = "user"
+
+# Version scope of the data a single course is rendered from.
+COURSE_SCOPE = "course"
+
+_lock = threading.Lock()
+
+_metrics = {
+    "hits": 0,
+    "misses": 0,
+}
+
+
+class FragmentCacheStore:
+    """Interface of the fragment cache stores."""
+
+    def get(self, key: str) -> str | None:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, timeout: int) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        return 0
+
+
+class NullFragmentCacheStore(FragmentCacheStore):
+    """Store that caches nothing, every fragment is rendered."""
+
+    def get(self, key: str) -> str | None:
+        return None
+
+    def set(self, key: str, value: str, timeout: int) -> None:
+        pass
+
+
+class MemoryFragmentCacheStore(FragmentCacheStore):
+    """Fragments held in the worker memory.
+
+    Keys embed the data versions, so stale fragments are never read again,
+    they expire after `timeout` or get evicted once there are more than
+    `max_entries` of them, least recently used first.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, timeout: int) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def create_store(app: Flask) -> FragmentCacheStore:
+    """Create the store named by `FRAGMENT_CACHE_STORE`.
+
+    Either `memory`, `null`, or the import path of a `FragmentCacheStore`
+    class taking the app.
+    """
+
+    name = app.config.get("FRAGMENT_CACHE_STORE", "memory")
+
+    if name == "memory":
+        return MemoryFragmentCacheStore(
+            app.config.get("FRAGMENT_CACHE_MAX_ENTRIES", 10_000)
+        )
+    if name == "null":
+        return NullFragmentCacheStore()
+
+    return import_string(name)(app)
+
+
+def get_store() -> FragmentCacheStore:
+    return app.extensions["fragment_cache"]
+
+
+# Data versions
+
+
+def get_user_scope(user_id) -> str:
+    return f"{USER_SCOPE}:{user_id}"
+
+
+def get_course_scope(course_id) -> str:
+    return f"{COURSE_SCOPE}:{course_id}"
+
+
+def bump_data_versions(connection, names: set[str]) -> None:
+    """Increment the data versions, invalidating the fragments using them."""
+
+    if not names:
+        return
+
+    # Sorted, so concurrent transactions lock the rows in the same order.
+    now = datetime.now()
+    stmt = pg_insert(DataVersion).values(
+        [{"name": name, "version": 1, "updated_at": now} for name in sorted(names)]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DataVersion.name],
+        set_={"version": DataVersion.version + 1, "updated_at": now},
+    )
+    connection.execute(stmt)
+
+
+def get_data_versions(names: list[str]) -> dict[str, int]:
+    versions = dict.fromkeys(names, 0)
+    versions.update(
+        db.session.execute(
+            select(DataVersion.name, DataVersion.version).filter(
+                DataVersion.name.in_(names)
+            )
+        ).all()
+    )
+    return versions
+
+
+def make_key(fragment: str, versions: tuple = (), vary: tuple = ()) -> str:
+    """Build the fragment key from the user, fragment and data versions."""
+
+    user_id = current_user.get_id() if current_user.is_authenticated else "anonymous"
+    names = [
+        get_user_scope(user_id) if name == USER_SCOPE else name for name in versions
+    ]
+    stamps = get_data_versions(names) if names else {}
+
+    digest = hashlib.sha1(
+        repr((user_id, sorted(stamps.items()), tuple(vary))).encode("utf-8")
+    ).hexdigest()
+
+    return f"fragment:{fragment}:{digest}"
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja `{% cache %}` tag.
+
+        {% cache "home_courses", versions=("courses", "user"), vary=(q,) %}
+            ...
+        {% endcache %}
+
+    The fragment is cached per user, `versions` names the data versions it
+    is rendered from, `user` being the current user data, and `vary` holds
+    the extra values it depends on, such as search terms.
+    """
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        args = [parser.parse_expression()]
+        kwargs = []
+        while parser.stream.skip_if("comma"):
+            key = parser.stream.expect("name").value
+            parser.stream.expect("assign")
+            kwargs.append(nodes.Keyword(key, parser.parse_expression(), lineno=lineno))
+
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+
+        return nodes.CallBlock(
+            self.call_method("_render_fragment", args, kwargs), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_fragment(
+        self, fragment: str, versions=(), vary=(), timeout=None, caller=None
+    ) -> str:
+        store = get_store()
+        key = make_key(fragment, tuple(versions), tuple(vary))
+
+        value = store.get(key)
+        if value is not None:
+            with _lock:
+                _metrics["hits"] += 1
+            return Markup(value)
+
+        with _lock:
+            _metrics["misses"] += 1
+
+        value = caller()
+        store.set(
+            key, str(value), timeout or app.config.get("FRAGMENT_CACHE_TIMEOUT", 300)
+        )
+
+        return value
+
+
+def init_app(app: Flask) -> None:
+    """Set up the fragment cache store and the `{% cache %}` tag."""
+
+    app.extensions["fragment_cache"] = create_store(app)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+def get_metrics() -> dict:
+    """Snapshot of the fragment cache counters of this worker."""
+
+    with _lock:
+        metrics = dict(_metrics)
+
+    metrics["entries"] = len(get_store())
+
+    return metrics
@@ -0,0 +1,127 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from flask import current_app as app
+
+from . import bcrypt
+
+# Per worker hashing pool, created lazily so it is never shared across forks.
+_lock = threading.Lock()
+_executor: ThreadPoolExecutor | None = None
+_slots: threading.BoundedSemaphore | None = None
+
+_metrics = {
+    "submitted": 0,
+    "started": 0,
+    "completed": 0,
+    "rejected": 0,
+    "timed_out": 0,
+    "rehashed": 0,
+    "queue_seconds_total": 0.0,
+    "queue_seconds_max": 0.0,
+}
+
+
+class PasswordHashingBusyError(Exception):
+    """Raised when the password hashing pool cannot take more work."""
+
+
+def _get_executor() -> tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+    global _executor, _slots
+
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                workers = app.config.get("PASSWORD_HASHING_WORKERS", 2)
+                queue_size = app.config.get("PASSWORD_HASHING_QUEUE_SIZE", 32)
+                _slots = threading.BoundedSemaphore(workers + queue_size)
+                _executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="password-hashing"
+                )
+
+    return _executor, _slots
+
+
+def _run(func, *args):
+    """Run bcrypt work on the hashing pool, rejecting it if the pool is full."""
+
+    executor, slots = _get_executor()
+
+    if not slots.acquire(blocking=False):
+        with _lock:
+            _metrics["rejected"] += 1
+        raise PasswordHashingBusyError("Password hashing queue is full")
+
+    enqueued_at = time.monotonic()
+
+    def task():
+        queue_seconds = time.monotonic() - enqueued_at
+        with _lock:
+            _metrics["started"] += 1
+            _metrics["queue_seconds_total"] += queue_seconds
+            _metrics["queue_seconds_max"] = max(
+                _metrics["queue_seconds_max"], queue_seconds
+            )
+        try:
+            return func(*args)
+        finally:
+            slots.release()
+            with _lock:
+                _metrics["completed"] += 1
+
+    with _lock:
+        _metrics["submitted"] += 1
+    future = executor.submit(task)
+
+    try:
+        return future.result(timeout=app.config.get("PASSWORD_HASHING_TIMEOUT", 10))
+    except FutureTimeoutError:
+        with _lock:
+            _metrics["timed_out"] += 1
+        raise PasswordHashingBusyError("Password hashing timed out")
+
+
+def hash_password(password: str) -> str:
+    """Hash the password with the configured work factor."""
+
+    rounds = app.config.get("BCRYPT_LOG_ROUNDS", 12)
+    password_hash = _run(bcrypt.generate_password_hash, password, rounds)
+
+    return password_hash.decode("utf-8")
+
+
+def check_password(password_hash: str, password: str) -> bool:
+    """Check the password against its hash."""
+
+    return _run(bcrypt.check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """Check whether the hash was made with a different work factor."""
+
+    try:
+        rounds = int(password_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return True
+
+    return rounds != app.config.get("BCRYPT_LOG_ROUNDS", 12)
+
+
+def record_rehash() -> None:
+    with _lock:
+        _metrics["rehashed"] += 1
+
+
+def get_metrics() -> dict:
+    """Snapshot of the hashing pool metrics of this worker."""
+
+    with _lock:
+        metrics = dict(_metrics)
+
+    started = metrics["started"] or 1
+    metrics["queue_seconds_avg"] = metrics["queue_seconds_total"] / started
+    metrics["in_flight"] = metrics["submitted"] - metrics["completed"]
+
+    return metrics
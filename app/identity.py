@@ -0,0 +1,102 @@
+import uuid
+
+from sqlalchemy import select
+
+from . import db
+from .models import User
+
+
+class UserIdentity:
+    """Compact snapshot of the logged in user backing `current_user`.
+
+    Only the columns needed on every request are kept, any other attribute
+    is looked up on the full `User` which is loaded on first access.
+    """
+
+    __slots__ = (
+        "user_id",
+        "username",
+        "fullname",
+        "group_id",
+        "is_active",
+        "is_staff",
+        "is_superuser",
+        "permissions_version",
+        "_user",
+    )
+
+    columns = (
+        User.user_id,
+        User.username,
+        User.fullname,
+        User.group_id,
+        User.is_active,
+        User.is_staff,
+        User.is_superuser,
+        User.permissions_version,
+    )
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, *values) -> None:
+        (
+            self.user_id,
+            self.username,
+            self.fullname,
+            self.group_id,
+            self.is_active,
+            self.is_staff,
+            self.is_superuser,
+            self.permissions_version,
+        ) = values
+        self._user = None
+
+    @property
+    def user(self) -> User:
+        """Full `User` of this identity, loaded once per request."""
+        if self._user is None:
+            self._user = db.session.get_one(User, ident=self.user_id)
+        return self._user
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def get_id(self) -> uuid.UUID:
+        return self.user_id
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (UserIdentity, User)):
+            return self.user_id == other.user_id
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.user_id)
+
+    def __repr__(self) -> str:
+        return f"UserIdentity<{self.username!r}>"
+
+
+def get_user_identity(user_id: uuid.UUID | str) -> UserIdentity | None:
+    """Load the identity of the user, or None if there is no such user.
+
+    This is one primary key lookup of the identity columns on every
+    authenticated request, nothing is cached across requests, so role and
+    permission changes made by any worker apply on the next request.
+    """
+
+    try:
+        user_id = uuid.UUID(str(user_id))
+    except ValueError:
+        return None
+
+    row = db.session.execute(
+        select(*UserIdentity.columns).filter(User.user_id == user_id)
+    ).one_or_none()
+
+    if row is None:
+        return None
+
+    return UserIdentity(*row)
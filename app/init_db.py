@@ -1,7 +1,7 @@
 from flask import Flask
 from sqlalchemy import or_, select
 
-from . import bcrypt, db
+from . import db, hashing
 from .consts import PERMISSIONS
 from .models import Group, Permission, User
 
@@ -41,7 +41,7 @@ def init_db_data(app: Flask) -> None:
             user = User(
                 username=username,
                 fullname="Admin User",
-                password_hash=bcrypt.generate_password_hash(password).decode("UTF-8"),
+                password_hash=hashing.hash_password(password),
                 group_id=group.group_id,
                 is_active=True,
                 is_staff=True,
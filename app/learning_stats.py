@@ -0,0 +1,381 @@
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import (
+    Date,
+    bindparam,
+    cast,
+    func,
+    inspect,
+    literal,
+    select,
+    text,
+    union,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import (
+    User,
+    UserAssessment,
+    UserCourse,
+    UserCourseLesson,
+    UserLearningStats,
+)
+
+STATS_COLUMNS = (
+    "courses_count",
+    "completed_courses_count",
+    "completed_assessments_count",
+    "learning_seconds",
+)
+
+# Timestamps marking a day of learning activity, by source model.
+ACTIVITY_COLUMNS = {
+    UserCourseLesson: (
+        "first_access_at",
+        "last_access_at",
+        "opened_at",
+        "closed_at",
+        "mark_completed_at",
+    ),
+    UserAssessment: ("started_at", "completed_at"),
+}
+
+
+def _previous_value(target, key: str):
+    """Get the attribute value from before the flush."""
+
+    history = inspect(target).attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.added:
+        return None
+    return getattr(target, key)
+
+
+def update_user_learning_stats(connection, user_id: uuid.UUID, **deltas) -> None:
+    """Add the deltas to the user learning stats, creating the row if missing."""
+
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    table = UserLearningStats.__table__
+    now = datetime.now()
+    stmt = pg_insert(UserLearningStats).values(
+        user_id=user_id, updated_at=now, **deltas
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserLearningStats.user_id],
+        set_={
+            **{column: table.c[column] + delta for column, delta in deltas.items()},
+            "updated_at": now,
+        },
+    )
+    connection.execute(stmt)
+
+
+def user_course_deltas(target, change: int) -> dict:
+    """Deltas of an inserted (1), updated (0) or deleted (-1) user course."""
+
+    is_completed = bool(target.is_completed)
+    if change:
+        return {
+            "courses_count": change,
+            "completed_courses_count": change * is_completed,
+        }
+
+    return {
+        "completed_courses_count": is_completed
+        - bool(_previous_value(target, "is_completed"))
+    }
+
+
+def user_assessment_deltas(target, change: int) -> dict:
+    """Deltas of an inserted (1), updated (0) or deleted (-1) user assessment."""
+
+    is_completed = bool(target.is_completed)
+    if change:
+        return {"completed_assessments_count": change * is_completed}
+
+    return {
+        "completed_assessments_count": is_completed
+        - bool(_previous_value(target, "is_completed"))
+    }
+
+
+def user_course_lesson_deltas(target, change: int) -> dict:
+    """Deltas of an inserted (1), updated (0) or deleted (-1) user lesson."""
+
+    seconds = target.seconds_spent or 0.0
+    if change:
+        return {"learning_seconds": change * seconds}
+
+    previous_seconds = _previous_value(target, "seconds_spent") or 0.0
+    return {"learning_seconds": seconds - previous_seconds}
+
+
+def refresh_learning_seconds(connection, user_ids: list[uuid.UUID]) -> None:
+    """Recompute the learning seconds of the users from their lessons.
+
+    Used where the lesson rows are written in bulk, bypassing the events.
+    """
+
+    if not user_ids:
+        return
+
+    rows = (
+        select(
+            UserCourseLesson.user_id,
+            func.coalesce(func.sum(UserCourseLesson.seconds_spent), 0),
+            literal(datetime.now()),
+        )
+        .filter(UserCourseLesson.user_id.in_(user_ids))
+        .group_by(UserCourseLesson.user_id)
+    )
+
+    stmt = pg_insert(UserLearningStats).from_select(
+        ["user_id", "learning_seconds", "updated_at"], rows
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserLearningStats.user_id],
+        set_={
+            "learning_seconds": stmt.excluded.learning_seconds,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    connection.execute(stmt)
+
+
+def rebuild_user_learning_stats(connection) -> int:
+    """Recompute the learning stats of every user from the source tables."""
+
+    # Hold back the event upserts, so no delta lands between the read and
+    # the overwrite, concurrent flushes wait for the rebuild to commit.
+    connection.execute(
+        text("LOCK TABLE user_learning_stats IN SHARE ROW EXCLUSIVE MODE")
+    )
+
+    courses = (
+        select(
+            UserCourse.user_id,
+            func.count().label("courses_count"),
+            func.count()
+            .filter(UserCourse.is_completed)
+            .label("completed_courses_count"),
+        )
+        .group_by(UserCourse.user_id)
+        .subquery()
+    )
+    assessments = (
+        select(
+            UserAssessment.user_id,
+            func.count()
+            .filter(UserAssessment.is_completed)
+            .label("completed_assessments_count"),
+        )
+        .group_by(UserAssessment.user_id)
+        .subquery()
+    )
+    lessons = (
+        select(
+            UserCourseLesson.user_id,
+            func.sum(UserCourseLesson.seconds_spent).label("learning_seconds"),
+        )
+        .group_by(UserCourseLesson.user_id)
+        .subquery()
+    )
+
+    rows = (
+        select(
+            User.user_id,
+            func.coalesce(courses.c.courses_count, 0),
+            func.coalesce(courses.c.completed_courses_count, 0),
+            func.coalesce(assessments.c.completed_assessments_count, 0),
+            func.coalesce(lessons.c.learning_seconds, 0),
+            literal(datetime.now()),
+        )
+        .outerjoin(courses, courses.c.user_id == User.user_id)
+        .outerjoin(assessments, assessments.c.user_id == User.user_id)
+        .outerjoin(lessons, lessons.c.user_id == User.user_id)
+    )
+
+    stmt = pg_insert(UserLearningStats).from_select(
+        ["user_id", *STATS_COLUMNS, "updated_at"], rows
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserLearningStats.user_id],
+        set_={
+            column: stmt.excluded[column] for column in (*STATS_COLUMNS, "updated_at")
+        },
+    )
+
+    return connection.execute(stmt).rowcount
+
+
+# Daily activity streaks
+
+
+def _bitmap_to_bits(bitmap: bytes | None) -> int:
+    return int.from_bytes(bitmap or b"", "little")
+
+
+def _bits_to_bitmap(bits: int) -> bytes:
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+def _longest_run(bits: int) -> int:
+    """Length of the longest run of set bits."""
+
+    length = 0
+    while bits:
+        bits &= bits >> 1
+        length += 1
+    return length
+
+
+def _run_ending_at(bits: int, index: int) -> int:
+    """Length of the run of set bits ending at the index bit."""
+
+    unset = ~bits & ((1 << (index + 1)) - 1)
+    if not unset:
+        return index + 1
+    return index - unset.bit_length() + 1
+
+
+def get_activity_days(target) -> set[date]:
+    """Get the days of the activity timestamps set in this flush."""
+
+    days = set()
+    state = inspect(target)
+    for key in ACTIVITY_COLUMNS.get(type(target), ()):
+        for value in state.attrs[key].history.added:
+            if value is not None:
+                days.add(value.date())
+    return days
+
+
+def record_user_activity(connection, user_id: uuid.UUID, days: set[date]) -> None:
+    """Mark the days in the user activity bitmap, and update his/her streaks."""
+
+    if not days:
+        return
+
+    connection.execute(
+        pg_insert(UserLearningStats)
+        .values(user_id=user_id, updated_at=datetime.now())
+        .on_conflict_do_nothing(index_elements=[UserLearningStats.user_id])
+    )
+    stats = connection.execute(
+        select(
+            UserLearningStats.activity_bitmap,
+            UserLearningStats.activity_started_on,
+            UserLearningStats.last_activity_on,
+            UserLearningStats.current_streak,
+            UserLearningStats.longest_streak,
+        )
+        .filter(UserLearningStats.user_id == user_id)
+        .with_for_update()
+    ).one()
+
+    bits = _bitmap_to_bits(stats.activity_bitmap)
+    started_on = stats.activity_started_on or min(days)
+    if min(days) < started_on:
+        bits <<= (started_on - min(days)).days
+        started_on = min(days)
+
+    for day in days:
+        bits |= 1 << (day - started_on).days
+
+    last_activity_on = stats.last_activity_on
+    current_streak = stats.current_streak
+    longest_streak = stats.longest_streak
+
+    if last_activity_on is None or min(days) >= last_activity_on:
+        # Activity moves forward in time, extend the streak in place.
+        for day in sorted(days):
+            if day == last_activity_on:
+                continue
+            if last_activity_on and day - last_activity_on == timedelta(days=1):
+                current_streak += 1
+            else:
+                current_streak = 1
+            last_activity_on = day
+        longest_streak = max(longest_streak, current_streak)
+    else:
+        # A past day was filled in, it may join two runs.
+        last_activity_on = max(last_activity_on, max(days))
+        current_streak = _run_ending_at(bits, (last_activity_on - started_on).days)
+        longest_streak = _longest_run(bits)
+
+    connection.execute(
+        update(UserLearningStats)
+        .filter(UserLearningStats.user_id == user_id)
+        .values(
+            activity_bitmap=_bits_to_bitmap(bits),
+            activity_started_on=started_on,
+            last_activity_on=last_activity_on,
+            current_streak=current_streak,
+            longest_streak=longest_streak,
+            updated_at=datetime.now(),
+        )
+    )
+
+
+def rebuild_user_activity(connection) -> int:
+    """Recompute the activity bitmaps and streaks from the source tables."""
+
+    stmt = union(
+        *(
+            select(model.user_id, cast(getattr(model, key), Date).label("day")).filter(
+                getattr(model, key).is_not(None)
+            )
+            for model, keys in ACTIVITY_COLUMNS.items()
+            for key in keys
+        )
+    )
+
+    days_by_user: dict[uuid.UUID, list[date]] = defaultdict(list)
+    for user_id, day in connection.execute(stmt):
+        days_by_user[user_id].append(day)
+
+    values = []
+    for user_id, days in days_by_user.items():
+        started_on, last_activity_on = min(days), max(days)
+        bits = 0
+        for day in days:
+            bits |= 1 << (day - started_on).days
+
+        values.append(
+            {
+                "b_user_id": user_id,
+                "activity_bitmap": _bits_to_bitmap(bits),
+                "activity_started_on": started_on,
+                "last_activity_on": last_activity_on,
+                "current_streak": _run_ending_at(
+                    bits, (last_activity_on - started_on).days
+                ),
+                "longest_streak": _longest_run(bits),
+            }
+        )
+
+    connection.execute(
+        update(UserLearningStats).values(
+            activity_bitmap=None,
+            activity_started_on=None,
+            last_activity_on=None,
+            current_streak=0,
+            longest_streak=0,
+        )
+    )
+    if values:
+        connection.execute(
+            update(UserLearningStats)
+            .filter(UserLearningStats.user_id == bindparam("b_user_id"))
+            .values({key: bindparam(key) for key in values[0] if key != "b_user_id"}),
+            values,
+        )
+
+    return len(values)
@@ -1,11 +1,15 @@
 import uuid
-from datetime import datetime
+from datetime import date, datetime
 
 from flask_login import UserMixin
 from sqlalchemy import (
+    BigInteger,
     Boolean,
+    Date,
     DateTime,
+    Float,
     ForeignKey,
+    Index,
     Integer,
     PrimaryKeyConstraint,
     String,
@@ -18,8 +22,10 @@ from . import db, login_manager
 
 
 @login_manager.user_loader
-def load_user(user_id: uuid.UUID) -> "User":
-    return db.session.get_one(User, ident=user_id)
+def load_user(user_id: uuid.UUID):
+    from .identity import get_user_identity
+
+    return get_user_identity(user_id)
 
 
 class Group(db.Model):
@@ -60,6 +66,12 @@ class User(db.Model, UserMixin):
     is_staff: Mapped[bool] = mapped_column(default=False)
     is_superuser: Mapped[bool] = mapped_column(default=False)
 
+    # Bumped whenever the user's permissions change, so per worker
+    # permission caches know when to reload.
+    permissions_version: Mapped[int] = mapped_column(
+        Integer(), nullable=False, default=0, server_default="0"
+    )
+
     registered_at: Mapped[datetime] = mapped_column(default=datetime.now)
     registered_by_id: Mapped[uuid.UUID] = mapped_column(
         pg.UUID(as_uuid=True), ForeignKey("users.user_id"), nullable=True
@@ -85,6 +97,22 @@ class User(db.Model, UserMixin):
 
     profile: Mapped["Profile"] = relationship(foreign_keys="Profile.user_id")
 
+    __table_args__ = (
+        # Trigram indexes of the `search` substring filters.
+        Index(
+            "ix_users_username_trgm",
+            "username",
+            postgresql_using="gin",
+            postgresql_ops={"username": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_users_fullname_trgm",
+            "fullname",
+            postgresql_using="gin",
+            postgresql_ops={"fullname": "gin_trgm_ops"},
+        ),
+    )
+
     def get_id(self) -> uuid.UUID:
         return self.user_id
 
@@ -183,6 +211,28 @@ class GroupPermission(db.Model):
         return (self.group_id, self.permission_id)
 
 
+class EffectivePermission(db.Model):
+    """Union of user and group permission grants, maintained by events."""
+
+    __tablename__ = "effective_permissions"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(
+        pg.UUID(as_uuid=True), ForeignKey("users.user_id"), nullable=False
+    )
+    permission_id: Mapped[uuid.UUID] = mapped_column(
+        pg.UUID(as_uuid=True), ForeignKey("permissions.permission_id"), nullable=False
+    )
+
+    # Source of the grant, the row is removed once both are cleared.
+    via_user: Mapped[bool] = mapped_column(Boolean(), nullable=False, default=False)
+    via_group: Mapped[bool] = mapped_column(Boolean(), nullable=False, default=False)
+
+    __table_args__ = (PrimaryKeyConstraint("user_id", "permission_id"),)
+
+    def get_id(self) -> tuple[uuid.UUID]:
+        return (self.user_id, self.permission_id)
+
+
 class Course(db.Model):
     __tablename__ = "courses"
 
@@ -195,6 +245,18 @@ class Course(db.Model):
     )
     summary: Mapped[str] = mapped_column(Text(), nullable=False)
     content: Mapped[str] = mapped_column(Text(), nullable=False)
+    # Sanitized `content`, rendered as is, and the sha256 of it which stamps
+    # the page ETag.
+    content_html: Mapped[str] = mapped_column(Text(), nullable=False)
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+
+    # Counters of the course users and lessons, maintained by events.
+    enrolled_count: Mapped[int] = mapped_column(
+        Integer(), nullable=False, default=0, server_default="0"
+    )
+    lessons_count: Mapped[int] = mapped_column(
+        Integer(), nullable=False, default=0, server_default="0"
+    )
 
     users: Mapped[list["UserCourse"]] = relationship(
         foreign_keys="UserCourse.course_id"
@@ -203,13 +265,19 @@ class Course(db.Model):
     assessment: Mapped["CourseAssessment"] = relationship()
     attachments: Mapped[list["Attachment"]] = relationship()
 
+    __table_args__ = (
+        # Trigram index of the `search` substring filters.
+        Index(
+            "ix_courses_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+    )
+
     def get_id(self) -> uuid.UUID:
         return self.course_id
 
-    @property
-    def enrolled_count(self):
-        return len(self.users)
-
     def __repr__(self) -> str:
         return f"Course<{self.name!r}>"
 
@@ -235,7 +303,9 @@ class UserCourse(db.Model):
         pg.UUID(as_uuid=True), ForeignKey("users.user_id"), nullable=False
     )
 
-    is_completed: Mapped[bool] = mapped_column(Boolean(), nullable=True, default=False)
+    is_completed: Mapped[bool] = mapped_column(
+        Boolean(), nullable=True, default=False, active_history=True
+    )
     completed_at: Mapped[datetime] = mapped_column(DateTime(), nullable=True)
 
     __table_args__ = (PrimaryKeyConstraint("user_id", "course_id"),)
@@ -254,6 +324,10 @@ class Lesson(db.Model):
     name: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
     index: Mapped[int] = mapped_column(Integer(), nullable=True)
     content: Mapped[str] = mapped_column(Text(), nullable=False)
+    # Sanitized `content`, rendered as is, and the sha256 of it which stamps
+    # the page ETag.
+    content_html: Mapped[str] = mapped_column(Text(), nullable=False)
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=False)
 
     courses: Mapped[list["CourseLesson"]] = relationship(back_populates="lesson")
 
@@ -291,9 +365,18 @@ class UserCourseLesson(db.Model):
 
     mark_skiped_at: Mapped[datetime] = mapped_column(DateTime(), nullable=True)
 
-    opened_at: Mapped[datetime] = mapped_column(DateTime(), nullable=True)
+    opened_at: Mapped[datetime] = mapped_column(
+        DateTime(), nullable=True, active_history=True
+    )
 
-    closed_at: Mapped[datetime] = mapped_column(DateTime(), nullable=True)
+    closed_at: Mapped[datetime] = mapped_column(
+        DateTime(), nullable=True, active_history=True
+    )
+
+    # Learning time, the gaps between the lesson progress events.
+    seconds_spent: Mapped[float] = mapped_column(
+        Float(), nullable=False, default=0.0, server_default="0", active_history=True
+    )
 
     __table_args__ = (PrimaryKeyConstraint("user_id", "course_id", "lesson_id"),)
 
@@ -355,7 +438,17 @@ class Attachment(db.Model):
 
     file_path: Mapped[str] = mapped_column(Text(), nullable=False)
 
-    file_data: Mapped[bytes] = mapped_column(pg.BYTEA(), nullable=False)
+    # Size and sha256 of the file, so serving it never loads it whole.
+    file_size: Mapped[int] = mapped_column(BigInteger(), nullable=False)
+    file_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+
+    # Name of the store holding the file, `database` for `file_data`.
+    storage: Mapped[str] = mapped_column(
+        String(32), nullable=False, default="database", server_default="database"
+    )
+
+    # Deferred, read in chunks by `attachments.iter_file_data`.
+    file_data: Mapped[bytes] = mapped_column(pg.BYTEA(), nullable=True, deferred=True)
 
     def get_id(self) -> uuid.UUID:
         return self.attachment_id
@@ -364,6 +457,24 @@ class Attachment(db.Model):
         return f"Attachment<{self.attachment_id}, {self.name}>"
 
 
+class AttachmentBlob(db.Model):
+    """Attachment file of a store, shared by the attachments of that content."""
+
+    __tablename__ = "attachment_blobs"
+
+    file_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    file_size: Mapped[int] = mapped_column(BigInteger(), nullable=False)
+    # Attachments using the blob, unreferenced blobs are removed by the
+    # `collect-attachment-blobs` command.
+    ref_count: Mapped[int] = mapped_column(
+        Integer(), nullable=False, default=0, server_default="0"
+    )
+    created_at: Mapped[datetime] = mapped_column(default=datetime.now)
+
+    def get_id(self) -> str:
+        return self.file_hash
+
+
 class Assessment(db.Model):
     __tablename__ = "assessments"
 
@@ -432,7 +543,7 @@ class UserAssessment(db.Model):
 
     is_started: Mapped[bool] = mapped_column(default=False)
 
-    is_completed: Mapped[bool] = mapped_column(default=False)
+    is_completed: Mapped[bool] = mapped_column(default=False, active_history=True)
 
     __table_args__ = (PrimaryKeyConstraint("user_id", "assessment_id"),)
 
@@ -440,6 +551,47 @@ class UserAssessment(db.Model):
         return (self.user_id, self.assessment_id)
 
 
+class UserLearningStats(db.Model):
+    """Per user learning rollup, maintained by events."""
+
+    __tablename__ = "user_learning_stats"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(
+        pg.UUID(as_uuid=True), ForeignKey("users.user_id"), primary_key=True
+    )
+
+    courses_count: Mapped[int] = mapped_column(
+        Integer(), nullable=False, default=0, server_default="0"
+    )
+    completed_courses_count: Mapped[int] = mapped_column(
+        Integer(), nullable=False, default=0, server_default="0"
+    )
+    completed_assessments_count: Mapped[int] = mapped_column(
+        Integer(), nullable=False, default=0, server_default="0"
+    )
+    learning_seconds: Mapped[float] = mapped_column(
+        Float(), nullable=False, default=0.0, server_default="0"
+    )
+
+    # One bit per day with activity, bit 0 is `activity_started_on`.
+    activity_bitmap: Mapped[bytes] = mapped_column(pg.BYTEA(), nullable=True)
+    activity_started_on: Mapped[date] = mapped_column(Date(), nullable=True)
+    last_activity_on: Mapped[date] = mapped_column(Date(), nullable=True)
+    current_streak: Mapped[int] = mapped_column(
+        Integer(), nullable=False, default=0, server_default="0"
+    )
+    longest_streak: Mapped[int] = mapped_column(
+        Integer(), nullable=False, default=0, server_default="0"
+    )
+
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(), nullable=False, default=datetime.now, onupdate=datetime.now
+    )
+
+    def get_id(self) -> uuid.UUID:
+        return self.user_id
+
+
 class Question(db.Model):
     __tablename__ = "questions"
 
@@ -582,8 +734,10 @@ class Mail(db.Model):
 class AuditLog(db.Model):
     __tablename__ = "audit_logs"
 
+    # Partitioned by month on `timestamp`, which has to be part of the
+    # primary key, see `audit.ensure_partitions`.
     audit_log_id: Mapped[uuid.UUID] = mapped_column(
-        pg.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
+        pg.UUID(as_uuid=True), default=uuid.uuid4
     )
 
     # Who
@@ -597,6 +751,42 @@ class AuditLog(db.Model):
     flag: Mapped[int] = mapped_column(Integer(), nullable=False)
     # Where
     table_name: Mapped[str] = mapped_column(String(255), nullable=False)
-    changed_data: Mapped[str] = mapped_column(Text(), nullable=True)
+    # Changed columns of updates as {"column": [old, new]}
+    changed_data: Mapped[dict] = mapped_column(pg.JSONB(), nullable=True)
     # Why
     justification: Mapped[str] = mapped_column(Text(), nullable=True, default="N/A")
+
+    __table_args__ = (
+        PrimaryKeyConstraint("audit_log_id", "timestamp"),
+        # Keyset pagination indexes, one per audit log browser filter.
+        Index("ix_audit_logs_timestamp", "timestamp", "audit_log_id"),
+        Index("ix_audit_logs_user_id", "user_id", "timestamp", "audit_log_id"),
+        Index("ix_audit_logs_table_name", "table_name", "timestamp", "audit_log_id"),
+        Index(
+            "ix_audit_logs_table_name_object_id",
+            "table_name",
+            "object_id",
+            "timestamp",
+            "audit_log_id",
+        ),
+        Index("ix_audit_logs_object_id", "object_id", "timestamp", "audit_log_id"),
+        Index("ix_audit_logs_changed_data", "changed_data", postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+
+class DataVersion(db.Model):
+    """Version counters of cached data, bumped by events on every change."""
+
+    __tablename__ = "data_versions"
+
+    name: Mapped[str] = mapped_column(String(255), primary_key=True)
+    version: Mapped[int] = mapped_column(
+        Integer(), nullable=False, default=0, server_default="0"
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(), nullable=True, default=datetime.now
+    )
+
+    def get_id(self) -> str:
+        return self.name
@@ -0,0 +1,241 @@
+import threading
+import uuid
+
+from sqlalchemy import delete, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from . import db
+from .models import EffectivePermission, GroupPermission, Permission, User
+
+# Per worker caches, permissions are static so their flags are loaded once,
+# user masks are keyed by user id and stamped with `User.permissions_version`.
+_lock = threading.Lock()
+_permission_flags: dict[str, int] = {}
+_user_masks: dict[uuid.UUID, tuple[int, int]] = {}
+
+
+def _bump_permissions_version_stmt(*criteria):
+    # Keep `User.last_login` as is, otherwise its onupdate fires.
+    return (
+        update(User)
+        .where(*criteria)
+        .values(
+            permissions_version=User.permissions_version + 1,
+            last_login=User.last_login,
+        )
+    )
+
+
+def permission_bit(flag: int) -> int:
+    """Convert a `Permission.flag` into its bit in the user mask."""
+    return 1 << flag
+
+
+def get_permission_flag(codename: str) -> int | None:
+    """Get the flag of permission by its codename."""
+
+    if not _permission_flags:
+        rows = db.session.execute(select(Permission.codename, Permission.flag)).all()
+        with _lock:
+            _permission_flags.update(dict(rows))
+
+    return _permission_flags.get(codename)
+
+
+def load_user_permission_mask(user_id: uuid.UUID) -> int:
+    """Resolve user permissions from the database into a bitmask."""
+
+    flags = db.session.execute(
+        select(Permission.flag)
+        .join(EffectivePermission)
+        .filter(EffectivePermission.user_id == user_id)
+    ).scalars()
+
+    mask = 0
+    for flag in flags:
+        mask |= permission_bit(flag)
+
+    return mask
+
+
+def get_user_permission_mask(user_id: uuid.UUID, version: int) -> int:
+    """Get the cached user permission mask, reloading it if it is stale."""
+
+    cached = _user_masks.get(user_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    mask = load_user_permission_mask(user_id)
+    with _lock:
+        _user_masks[user_id] = (version, mask)
+
+    return mask
+
+
+def has_permission(user: User, codename: str) -> bool:
+    """Check whether the user has been granted the permission."""
+
+    flag = get_permission_flag(codename)
+    if flag is None:
+        return False
+
+    mask = get_user_permission_mask(user.user_id, user.permissions_version)
+
+    return bool(mask & permission_bit(flag))
+
+
+def bump_user_permissions_version(user_id: uuid.UUID | str) -> None:
+    """Invalidate cached permissions of the user in every worker.
+
+    Must be called within the transaction that changes the user permissions.
+    """
+
+    db.session.execute(_bump_permissions_version_stmt(User.user_id == user_id))
+
+    user_id = uuid.UUID(str(user_id))
+    with _lock:
+        _user_masks.pop(user_id, None)
+
+
+# Effective permissions maintenance, these run inside the flush of the
+# changed rows so they operate on the flush connection directly.
+
+
+def _prune_effective_permissions(connection, *criteria) -> None:
+    connection.execute(
+        delete(EffectivePermission).where(
+            *criteria,
+            EffectivePermission.via_user.is_(False),
+            EffectivePermission.via_group.is_(False),
+        )
+    )
+
+
+def grant_user_permission(
+    connection, user_id: uuid.UUID, permission_id: uuid.UUID
+) -> None:
+    """Mark the permission as directly granted to the user."""
+
+    stmt = pg_insert(EffectivePermission).values(
+        user_id=user_id, permission_id=permission_id, via_user=True, via_group=False
+    )
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["user_id", "permission_id"], set_={"via_user": True}
+        )
+    )
+
+
+def revoke_user_permission(
+    connection, user_id: uuid.UUID, permission_id: uuid.UUID
+) -> None:
+    """Clear the direct grant of the permission from the user."""
+
+    criteria = (
+        EffectivePermission.user_id == user_id,
+        EffectivePermission.permission_id == permission_id,
+    )
+    connection.execute(
+        update(EffectivePermission).where(*criteria).values(via_user=False)
+    )
+    _prune_effective_permissions(connection, *criteria)
+
+
+def grant_group_permission(
+    connection, group_id: uuid.UUID, permission_id: uuid.UUID
+) -> None:
+    """Grant the permission to every member of the group."""
+
+    members = select(
+        User.user_id,
+        literal(permission_id, type_=EffectivePermission.permission_id.type),
+        literal(False),
+        literal(True),
+    ).where(User.group_id == group_id)
+
+    stmt = pg_insert(EffectivePermission).from_select(
+        ["user_id", "permission_id", "via_user", "via_group"], members
+    )
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["user_id", "permission_id"], set_={"via_group": True}
+        )
+    )
+    connection.execute(_bump_permissions_version_stmt(User.group_id == group_id))
+
+
+def revoke_group_permission(
+    connection, group_id: uuid.UUID, permission_id: uuid.UUID
+) -> None:
+    """Clear the group grant of the permission from every group member."""
+
+    criteria = (
+        EffectivePermission.user_id.in_(
+            select(User.user_id).where(User.group_id == group_id)
+        ),
+        EffectivePermission.permission_id == permission_id,
+    )
+    connection.execute(
+        update(EffectivePermission).where(*criteria).values(via_group=False)
+    )
+    _prune_effective_permissions(connection, *criteria)
+    connection.execute(_bump_permissions_version_stmt(User.group_id == group_id))
+
+
+def sync_user_group_permissions(
+    connection, user_id: uuid.UUID, group_id: uuid.UUID | None
+) -> None:
+    """Replace user group grants with the grants of his/her current group."""
+
+    criteria = (EffectivePermission.user_id == user_id,)
+    connection.execute(
+        update(EffectivePermission).where(*criteria).values(via_group=False)
+    )
+
+    if group_id is not None:
+        group_permissions = select(
+            literal(user_id, type_=EffectivePermission.user_id.type),
+            GroupPermission.permission_id,
+            literal(False),
+            literal(True),
+        ).where(GroupPermission.group_id == group_id)
+
+        stmt = pg_insert(EffectivePermission).from_select(
+            ["user_id", "permission_id", "via_user", "via_group"], group_permissions
+        )
+        connection.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["user_id", "permission_id"],
+                set_={"via_group": True},
+            )
+        )
+
+    _prune_effective_permissions(connection, *criteria)
+    connection.execute(_bump_permissions_version_stmt(User.user_id == user_id))
+
+
+def grant_group_permissions_to_users(connection, user_ids: list[uuid.UUID]) -> None:
+    """Materialize group grants for users inserted in bulk."""
+
+    if not user_ids:
+        return
+
+    group_permissions = (
+        select(
+            User.user_id,
+            GroupPermission.permission_id,
+            literal(False),
+            literal(True),
+        )
+        .join(GroupPermission, GroupPermission.group_id == User.group_id)
+        .where(User.user_id.in_(user_ids))
+    )
+
+    stmt = pg_insert(EffectivePermission).from_select(
+        ["user_id", "permission_id", "via_user", "via_group"], group_permissions
+    )
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["user_id", "permission_id"], set_={"via_group": True}
+        )
+    )
@@ -0,0 +1,293 @@
+import atexit
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from flask import current_app as app
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from . import db, fragment_cache, learning_stats
+from .models import CourseLesson, UserCourse, UserCourseLesson
+
+OPEN_EVENT = "open"
+HEARTBEAT_EVENT = "heartbeat"
+CLOSE_EVENT = "close"
+
+EVENTS = (OPEN_EVENT, HEARTBEAT_EVENT, CLOSE_EVENT)
+
+_lock = threading.Lock()
+_buffer: "ProgressBuffer | None" = None
+
+_metrics = {
+    "received": 0,
+    "dropped": 0,
+    "rejected": 0,
+    "written": 0,
+    "failed": 0,
+    "flushes": 0,
+}
+
+
+def _add_metric(name: str, value: int = 1) -> None:
+    with _lock:
+        _metrics[name] += value
+
+
+def _min(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+class ProgressBuffer:
+    """Lesson progress events merged in the worker memory, and written behind.
+
+    Events of the same user lesson are merged into a single pending row,
+    keeping the first open and the last close or heartbeat.
+    The learning time adds up the gaps before each heartbeat and close, from
+    the previous event of the lesson and capped at `PROGRESS_MAX_GAP`, an
+    open starts a new session, and events older than the last one add nothing.
+    Pending rows are lost if the worker gets killed before its flush.
+    """
+
+    def __init__(self, engine, config) -> None:
+        self.engine = engine
+        self.pid = os.getpid()
+        self.flush_interval = config.get("PROGRESS_FLUSH_INTERVAL", 5.0)
+        self.batch_size = config.get("PROGRESS_BATCH_SIZE", 1000)
+        self.max_keys = config.get("PROGRESS_BUFFER_MAX_KEYS", 50_000)
+        self.max_gap = config.get("PROGRESS_MAX_GAP", 60.0)
+        self.logger = app.logger
+
+        self.rows: dict[tuple[uuid.UUID, uuid.UUID, uuid.UUID], dict] = {}
+        self.rows_lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+        self.thread = threading.Thread(
+            target=self._run, name="progress-writer", daemon=True
+        )
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def add(
+        self,
+        user_id: uuid.UUID,
+        course_id: uuid.UUID,
+        lesson_id: uuid.UUID,
+        event: str,
+        at: datetime,
+    ) -> bool:
+        key = (user_id, course_id, lesson_id)
+
+        with self.rows_lock:
+            row = self.rows.get(key)
+            if row is None:
+                if len(self.rows) >= self.max_keys:
+                    _add_metric("dropped")
+                    return False
+                row = self.rows[key] = {
+                    "user_id": user_id,
+                    "course_id": course_id,
+                    "lesson_id": lesson_id,
+                    "first_access_at": at,
+                    "last_access_at": at,
+                    "opened_at": None,
+                    "closed_at": None,
+                    "seconds_spent": 0.0,
+                    # Joined to the last event written, see `write_rows`.
+                    "first_event": event,
+                }
+            elif event != OPEN_EVENT and at > row["last_access_at"]:
+                row["seconds_spent"] += get_gap_seconds(
+                    row["last_access_at"], at, self.max_gap
+                )
+
+            if at < row["first_access_at"]:
+                row["first_event"] = event
+            row["first_access_at"] = _min(row["first_access_at"], at)
+            row["last_access_at"] = _max(row["last_access_at"], at)
+            if event == OPEN_EVENT:
+                row["opened_at"] = _min(row["opened_at"], at)
+            else:
+                row["closed_at"] = _max(row["closed_at"], at)
+
+            pending = len(self.rows)
+
+        _add_metric("received")
+        if pending >= self.batch_size:
+            self.wakeup.set()
+
+        return True
+
+    def _take_rows(self) -> list[dict]:
+        with self.rows_lock:
+            rows, self.rows = self.rows, {}
+        return list(rows.values())
+
+    def _run(self) -> None:
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        rows = self._take_rows()
+        if not rows:
+            return
+
+        try:
+            with self.engine.begin() as connection:
+                write_rows(connection, rows, self.max_gap)
+            _add_metric("flushes")
+        except Exception as e:
+            self.logger.error(f"Progress writer failed: {e}")
+            _add_metric("failed", len(rows))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+def get_gap_seconds(previous_at: datetime, at: datetime, max_gap: float) -> float:
+    """Learning seconds between two events, long gaps being idle time."""
+
+    return min(max((at - previous_at).total_seconds(), 0.0), max_gap)
+
+
+def write_rows(connection, rows: list[dict], max_gap: float) -> None:
+    """Upsert the pending rows of enrolled users, and refresh their stats."""
+
+    keys = [(row["user_id"], row["course_id"], row["lesson_id"]) for row in rows]
+    enrolled_keys = set(
+        connection.execute(
+            select(UserCourse.user_id, CourseLesson.course_id, CourseLesson.lesson_id)
+            .join(CourseLesson, CourseLesson.course_id == UserCourse.course_id)
+            .filter(
+                tuple_(
+                    UserCourse.user_id, CourseLesson.course_id, CourseLesson.lesson_id
+                ).in_(keys)
+            )
+        ).all()
+    )
+
+    values = [
+        {
+            **row,
+            "is_accessed": True,
+            "is_marked_completed": False,
+            "is_marked_skiped": False,
+        }
+        for row, key in zip(rows, keys, strict=True)
+        if key in enrolled_keys
+    ]
+    _add_metric("rejected", len(rows) - len(values))
+    if not values:
+        return
+
+    # Sorted, so concurrent flushes lock the rows in the same order.
+    values.sort(key=lambda row: (row["user_id"], row["course_id"], row["lesson_id"]))
+
+    # Locked, so concurrent flushes of a lesson join its events in turn.
+    key_columns = (
+        UserCourseLesson.user_id,
+        UserCourseLesson.course_id,
+        UserCourseLesson.lesson_id,
+    )
+    last_access = {
+        tuple(row[:3]): row[3]
+        for row in connection.execute(
+            select(*key_columns, UserCourseLesson.last_access_at)
+            .filter(tuple_(*key_columns).in_(list(enrolled_keys)))
+            .order_by(*key_columns)
+            .with_for_update()
+        )
+    }
+
+    # Join the first pending event to the last event written.
+    for row in values:
+        first_event = row.pop("first_event")
+        last_access_at = last_access.get(
+            (row["user_id"], row["course_id"], row["lesson_id"])
+        )
+        if first_event != OPEN_EVENT and last_access_at is not None:
+            row["seconds_spent"] += get_gap_seconds(
+                last_access_at, row["first_access_at"], max_gap
+            )
+
+    for start in range(0, len(values), 1000):
+        stmt = pg_insert(UserCourseLesson).values(values[start : start + 1000])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "course_id", "lesson_id"],
+            set_={
+                "first_access_at": func.least(
+                    UserCourseLesson.first_access_at, stmt.excluded.first_access_at
+                ),
+                "last_access_at": func.greatest(
+                    UserCourseLesson.last_access_at, stmt.excluded.last_access_at
+                ),
+                "is_accessed": True,
+                "opened_at": func.least(
+                    UserCourseLesson.opened_at, stmt.excluded.opened_at
+                ),
+                "closed_at": func.greatest(
+                    UserCourseLesson.closed_at, stmt.excluded.closed_at
+                ),
+                "seconds_spent": UserCourseLesson.seconds_spent
+                + stmt.excluded.seconds_spent,
+            },
+        )
+        connection.execute(stmt)
+
+    _add_metric("written", len(values))
+
+    # The upserts skip the mapper events, keep the derived data in step.
+    days_by_user: dict[uuid.UUID, set] = {}
+    for row in values:
+        days = days_by_user.setdefault(row["user_id"], set())
+        for key in learning_stats.ACTIVITY_COLUMNS[UserCourseLesson]:
+            if row.get(key) is not None:
+                days.add(row[key].date())
+
+    learning_stats.refresh_learning_seconds(connection, list(days_by_user))
+    for user_id, days in days_by_user.items():
+        learning_stats.record_user_activity(connection, user_id, days)
+    fragment_cache.bump_data_versions(
+        connection, {fragment_cache.get_user_scope(user_id) for user_id in days_by_user}
+    )
+
+
+def get_buffer() -> ProgressBuffer:
+    global _buffer
+
+    # Started lazily, and again in each forked worker.
+    if _buffer is None or _buffer.pid != os.getpid():
+        with _lock:
+            if _buffer is None or _buffer.pid != os.getpid():
+                _buffer = ProgressBuffer(db.engine, app.config)
+
+    return _buffer
+
+
+def record_event(
+    user_id: uuid.UUID, course_id: uuid.UUID, lesson_id: uuid.UUID, event: str
+) -> bool:
+    """Buffer a lesson progress event, returning False if it was dropped."""
+
+    if event not in EVENTS:
+        raise ValueError(f"Invalid progress event {event!r}")
+
+    return get_buffer().add(user_id, course_id, lesson_id, event, datetime.now())
+
+
+def get_metrics() -> dict:
+    """Snapshot of the progress beacon metrics of this worker."""
+
+    with _lock:
+        metrics = dict(_metrics)
+
+    metrics["pending"] = len(_buffer) if _buffer else 0
+
+    return metrics
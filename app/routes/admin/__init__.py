@@ -1,8 +1,13 @@
+import io
+import os
+import uuid
 from datetime import datetime
 
+import click
 from flask import (
     Blueprint,
     flash,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -12,12 +17,27 @@ from flask import (
     current_app as app,
 )
 from flask_login import current_user
-from sqlalchemy import not_, or_, select
-
-from ... import bcrypt, consts, db, utils
+from sqlalchemy import not_, select
+
+from ... import (
+    attachments,
+    audit,
+    consts,
+    courses,
+    db,
+    fragment_cache,
+    hashing,
+    learning_stats,
+    progress,
+    search,
+    throttling,
+    user_import,
+    utils,
+)
 from ...decorators import permission_required, superuser_required
 from ...models import Permission, User, UserPermission
-from .forms import AssignUserPermissionForm, RegisterNewUserForm
+from ...permissions import bump_user_permissions_version
+from .forms import AssignUserPermissionForm, ImportUsersForm, RegisterNewUserForm
 
 bp = Blueprint("admin", __name__, template_folder="templates")
 
@@ -48,7 +68,12 @@ def register_user():
                 flash(f"User with username: {username} already exists.", "warning")
                 return redirect(url_for("admin.register_user"))
 
-            password_hash = bcrypt.generate_password_hash(password).decode("utf-8")
+            try:
+                password_hash = hashing.hash_password(password)
+            except hashing.PasswordHashingBusyError:
+                flash("Server is busy right now, Please try again shortly.", "warning")
+                return redirect(url_for("admin.register_user"))
+
             user = User(
                 fullname=fullname,
                 username=username,
@@ -74,6 +99,145 @@ def register_user():
     return render_template("admin/register_user.html", form=form, title="Register User")
 
 
+@bp.route("import-users", methods=["GET", "POST"])
+@superuser_required
+def import_users():
+    """Import Users From CSV File"""
+
+    form = ImportUsersForm()
+    report = None
+
+    if form.validate_on_submit():
+        stream = io.TextIOWrapper(
+            form.file.data.stream, encoding="utf-8-sig", newline=""
+        )
+
+        try:
+            report = user_import.import_users(
+                stream,
+                current_user.get_id(),
+                max_rows=app.config.get("USER_IMPORT_MAX_ROWS", 5000),
+            )
+            flash(
+                f"<b>{report.created_count}</b> of <b>{report.rows_count}</b> users imported.",
+                "success" if not report.errors else "warning",
+            )
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f"Invalid CSV file: {e}", "danger")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(e)
+            flash("Something went wrong, Please try again later.", "danger")
+
+    return render_template(
+        "admin/import_users.html", form=form, report=report, title="Import Users"
+    )
+
+
+@bp.route("/metrics", methods=["GET"])
+@superuser_required
+def metrics():
+    """Worker Metrics"""
+
+    return jsonify(
+        {
+            "password_hashing": hashing.get_metrics(),
+            "login_throttling": throttling.get_metrics(),
+            "audit_log": audit.get_metrics(),
+            "fragment_cache": fragment_cache.get_metrics(),
+            "lesson_progress": progress.get_metrics(),
+        }
+    )
+
+
+def _get_audit_log_page(args) -> tuple[dict, list, str | None]:
+    """Parse the audit log filters of the request args, and query their page."""
+
+    filters = {
+        "username": args.get("username", "").strip(),
+        "table_name": args.get("table_name", "").strip(),
+        "object_id": args.get("object_id", "").strip(),
+        "since": args.get("since", "").strip(),
+        "until": args.get("until", "").strip(),
+    }
+
+    user_id = None
+    if args.get("user_id"):
+        user_id = uuid.UUID(args["user_id"])
+    elif filters["username"]:
+        user_id = db.session.execute(
+            select(User.user_id).filter(User.username == filters["username"])
+        ).scalar_one_or_none()
+        if user_id is None:
+            return filters, [], None
+
+    max_page_size = app.config.get("AUDIT_LOG_PAGE_SIZE", 50)
+    limit = min(args.get("limit", max_page_size, type=int), max_page_size)
+
+    rows, next_cursor = audit.query_audit_logs(
+        user_id=user_id,
+        table_name=filters["table_name"] or None,
+        object_id=filters["object_id"] or None,
+        since=datetime.fromisoformat(filters["since"]) if filters["since"] else None,
+        until=datetime.fromisoformat(filters["until"]) if filters["until"] else None,
+        cursor=args.get("cursor") or None,
+        limit=max(limit, 1),
+    )
+
+    return filters, rows, next_cursor
+
+
+@bp.route("/audit-logs", methods=["GET"])
+@superuser_required
+def audit_logs():
+    """Browse Audit Logs"""
+
+    try:
+        filters, rows, next_cursor = _get_audit_log_page(request.args)
+    except ValueError as e:
+        flash(f"Invalid audit log filters: {e}", "warning")
+        return redirect(url_for("admin.audit_logs"))
+
+    return render_template(
+        "admin/audit_logs.html",
+        filters=filters,
+        audit_logs=rows,
+        next_cursor=next_cursor,
+        title="Audit Logs",
+    )
+
+
+@bp.route("/api/audit-logs", methods=["GET"])
+@superuser_required
+def audit_logs_api():
+    """Audit Logs JSON API"""
+
+    try:
+        _, rows, next_cursor = _get_audit_log_page(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(
+        {
+            "audit_logs": [
+                {
+                    "audit_log_id": str(row.audit_log_id),
+                    "timestamp": row.timestamp.isoformat(),
+                    "user_id": str(row.user_id),
+                    "username": row.username,
+                    "table_name": row.table_name,
+                    "object_id": row.object_id,
+                    "flag": row.flag,
+                    "changed_data": row.changed_data,
+                    "justification": row.justification,
+                }
+                for row in rows
+            ],
+            "next_cursor": next_cursor,
+        }
+    )
+
+
 @bp.route("/panel", methods=["GET"])
 @permission_required(consts.PermissionEnum.CAN_ASSIGN_USER_COURSE)
 def panel():
@@ -82,15 +246,17 @@ def panel():
     q_user = request.args.get("q_user", "")
 
     users = db.session.execute(
-        select(
-            User.user_id,
-            User.fullname,
-            User.is_active,
-            User.is_staff,
-            User.is_superuser,
-        )
-        .select_from(User)
-        .filter(or_(User.username.icontains(q_user), User.fullname.icontains(q_user)))
+        search.search(
+            select(
+                User.user_id,
+                User.fullname,
+                User.is_active,
+                User.is_staff,
+                User.is_superuser,
+            ).select_from(User),
+            (User.username, User.fullname),
+            q_user,
+        ).order_by(User.fullname)
     )
 
     return render_template(
@@ -158,6 +324,7 @@ def assign_user_permission(user_id: str):
 
         try:
             db.session.add(user_permission)
+            bump_user_permissions_version(user_id)
             flash(
                 f"Permission <b>{db_permission.name}</b> assigned successfully for <b>{user.fullname}</b>.",
                 "info",
@@ -231,6 +398,7 @@ def delete_user_permission(user_id: str, permission_id: str):
 
     try:
         db.session.delete(user_permission)
+        bump_user_permissions_version(user_id)
         flash(
             f"Permission <b>{permission.name}</b> removed from  <b>{user.fullname}</b>",
             "info",
@@ -243,3 +411,123 @@ def delete_user_permission(user_id: str, permission_id: str):
         flash("Something went wrong, Please try again later.", "danger")
 
     return redirect(url_for("admin.panel"))
+
+
+@bp.cli.command("import-users")
+@click.argument("csv_path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--registered-by",
+    default=None,
+    help="Username of the registering user, defaults to FIRST_SUPERUSER.",
+)
+@click.option(
+    "--workers",
+    default=os.cpu_count() or 1,
+    show_default=True,
+    type=int,
+    help="Password hashing processes.",
+)
+def import_users_command(csv_path: str, registered_by: str | None, workers: int):
+    """Import users from a CSV file."""
+
+    username = registered_by or app.config.get("FIRST_SUPERUSER")
+    registered_by_id = db.session.execute(
+        select(User.user_id).filter(User.username == username)
+    ).scalar_one_or_none()
+
+    if not registered_by_id:
+        raise click.ClickException(f"User with username: {username} does not exist.")
+
+    with open(csv_path, encoding="utf-8-sig", newline="") as stream:
+        try:
+            report = user_import.import_users(stream, registered_by_id, workers=workers)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    for error in report.errors:
+        click.echo(f"line {error.line}: {error.username}: {error.message}", err=True)
+
+    click.echo(f"{report.created_count} of {report.rows_count} users imported.")
+
+
+@bp.cli.command("audit-partitions")
+@click.option("--months-ahead", default=3, show_default=True, type=int)
+def audit_partitions_command(months_ahead: int):
+    """Create the monthly audit log partitions ahead of time."""
+
+    with db.engine.begin() as connection:
+        created = audit.ensure_partitions(connection, months_ahead=months_ahead)
+
+    click.echo(f"Created partitions: {', '.join(created) or 'None'}")
+
+
+@bp.cli.command("audit-retention")
+@click.option("--keep-months", default=None, type=int)
+@click.option("--archive-dir", default=None, type=click.Path(file_okay=False))
+def audit_retention_command(keep_months: int | None, archive_dir: str | None):
+    """Archive and drop the audit log partitions past retention."""
+
+    keep_months = keep_months or app.config.get("AUDIT_RETENTION_MONTHS", 12)
+    archive_dir = (
+        archive_dir
+        or app.config.get("AUDIT_ARCHIVE_DIR")
+        or os.path.join(app.instance_path, "audit-archive")
+    )
+
+    for path in audit.apply_retention(db.engine, keep_months, archive_dir):
+        click.echo(f"Archived {path}")
+
+
+@bp.cli.command("rebuild-learning-stats")
+def rebuild_learning_stats_command():
+    """Recompute the user learning stats and streaks from the learning rows."""
+
+    with db.engine.begin() as connection:
+        count = learning_stats.rebuild_user_learning_stats(connection)
+        active_count = learning_stats.rebuild_user_activity(connection)
+
+    click.echo(f"Rebuilt learning stats of {count} users, {active_count} active.")
+
+
+@bp.cli.command("rebuild-course-counters")
+def rebuild_course_counters_command():
+    """Recompute the course enrolled and lessons counters."""
+
+    with db.engine.begin() as connection:
+        courses.rebuild_course_counters(connection)
+
+    click.echo("Rebuilt course counters.")
+
+
+@bp.cli.command("move-attachments")
+@click.option("--batch-size", default=100, show_default=True, type=int)
+def move_attachments_command(batch_size: int):
+    """Move the attachment files kept in the database into the store."""
+
+    store = attachments.get_store()
+
+    moved_count = 0
+    while moved := attachments.move_database_attachments(store, batch_size):
+        db.session.commit()
+        moved_count += moved
+        click.echo(f"Moved {moved_count} attachments.")
+
+    click.echo(f"Moved {moved_count} attachments to the {store.name} store.")
+
+
+@bp.cli.command("collect-attachment-blobs")
+@click.option("--batch-size", default=1000, show_default=True, type=int)
+def collect_attachment_blobs_command(batch_size: int):
+    """Remove the attachment files no attachment references anymore."""
+
+    store = attachments.get_store()
+
+    collected_count = 0
+    while True:
+        with db.engine.begin() as connection:
+            collected = attachments.collect_blobs(connection, store, batch_size)
+        if not collected:
+            break
+        collected_count += collected
+
+    click.echo(f"Removed {collected_count} attachment files.")
@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField, FileRequired
 from sqlalchemy import select
 from wtforms import (
     BooleanField,
@@ -33,6 +34,14 @@ class RegisterNewUserForm(FlaskForm):
         ]
 
 
+class ImportUsersForm(FlaskForm):
+    file = FileField(
+        "Users CSV File",
+        validators=[FileRequired(), FileAllowed(["csv"], message="CSV files only")],
+    )
+    submit = SubmitField("Import")
+
+
 class AssignUserPermissionForm(FlaskForm):
     permission = SelectField(
         "Permission", validators=[UUID(message="Choose Valid Permission")]
@@ -15,7 +15,7 @@ from flask import (
 from flask_login import current_user, login_required, login_user, logout_user
 from sqlalchemy import select, update
 
-from ... import bcrypt, db, utils
+from ... import db, hashing, throttling, utils
 from ...models import User
 from .forms import ChangePasswordForm, LoginForm
 
@@ -39,6 +39,11 @@ def login() -> Any:
             username = form.username.data
             password = form.password.data
 
+            # Shed excess attempts before any query or hashing work.
+            if not throttling.allow_login_attempt(username, request.remote_addr):
+                flash("Too many login attempts, Please try again later.", "danger")
+                return redirect(url_for("auth.login"))
+
             stmt = select(User).filter(User.username == username)
             user = db.session.execute(stmt).scalar_one_or_none()
 
@@ -50,17 +55,31 @@ def login() -> Any:
                 flash("Your account is in active. Kindly contact the admin.", "warning")
                 return redirect(url_for("auth.login"))
 
-            if bcrypt.check_password_hash(user.password_hash, password):
+            try:
+                is_valid_password = hashing.check_password(user.password_hash, password)
+            except hashing.PasswordHashingBusyError:
+                flash("Server is busy right now, Please try again shortly.", "warning")
+                return redirect(url_for("auth.login"))
+
+            if is_valid_password:
                 login_user(user=user, remember=form.remember.data)
                 flash(
                     f"Logged in successfully as <b>{user.fullname if user.fullname else username}</b>",
                     "success",
                 )
+                values = {"last_login": datetime.now()}
+                try:
+                    # Upgrade hashes made with an outdated work factor.
+                    if hashing.needs_rehash(user.password_hash):
+                        values["password_hash"] = hashing.hash_password(password)
+                        hashing.record_rehash()
+                except hashing.PasswordHashingBusyError:
+                    pass
                 try:
                     db.session.execute(
                         update(User)
                         .where(User.user_id == user.get_id())
-                        .values(last_login=datetime.now())
+                        .values(**values)
                     )
                     db.session.commit()
                 except Exception as e:
@@ -108,9 +127,13 @@ def change_password():
         new_password = form.new_password.data
         new_password_confirm = form.new_password_confirm.data
 
-        if not bcrypt.check_password_hash(current_user.password_hash, old_password):
-            flash("Old password does not match your password.", "danger")
-            return redirect(url_for("auth.profile"))
+        try:
+            if not hashing.check_password(current_user.password_hash, old_password):
+                flash("Old password does not match your password.", "danger")
+                return redirect(url_for("auth.profile"))
+        except hashing.PasswordHashingBusyError:
+            flash("Server is busy right now, Please try again shortly.", "warning")
+            return redirect(url_for("auth.change_password"))
 
         if new_password != new_password_confirm:
             flash("New password does not match.", "warning")
@@ -118,20 +141,20 @@ def change_password():
 
         try:
             db.session.execute(
-                update(User).values(
-                    password_hash=bcrypt.generate_password_hash(new_password).decode(
-                        "utf-8"
-                    )
-                )
+                update(User)
+                .where(User.user_id == current_user.get_id())
+                .values(password_hash=hashing.hash_password(new_password))
             )
             db.session.commit()
             flash("Password updated successfully. Login back here", "success")
             # return redirect(url_for('auth.profile'))
             logout_user()
             return redirect(url_for("auth.login"))
-        except Exception:
+        except hashing.PasswordHashingBusyError:
+            flash("Server is busy right now, Please try again shortly.", "warning")
+        except Exception as e:
             db.session.rollback()
-            app.logger.error()
+            app.logger.error(e)
             flash("Something went wrong, Please try again later", "danger")
 
     return render_template("auth/change_password.html", form=form)
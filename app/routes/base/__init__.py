@@ -1,21 +1,35 @@
-from datetime import timedelta
-
-from flask import Blueprint, flash, jsonify, redirect, render_template, request, url_for
+import uuid
+
+from flask import (
+    Blueprint,
+    flash,
+    jsonify,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
 from flask_login import current_user, login_required
-from sqlalchemy import and_, desc, func, select
+from sqlalchemy import desc, select
+from sqlalchemy.orm import contains_eager
 
-from ... import db
+from ... import attachments, courses, db, progress, search
 from ...models import (
     Assessment,
+    Attachment,
     Course,
-    CourseLesson,
+    Lesson,
     User,
     UserAssessment,
     UserCourse,
-    UserCourseLesson,
 )
-from ...utils import SECONDS_TO_HOURS
-from .utils import UserMetrics
+from .utils import (
+    get_course_page_validators,
+    get_user_metrics,
+    is_not_modified,
+    set_page_validators,
+)
 
 bp = Blueprint("base", __name__, template_folder="templates")
 
@@ -39,6 +53,7 @@ def home():
         .join(User, onclause=(User.user_id == UserCourse.user_id))
         .filter(User.user_id == current_user.get_id())
         .order_by(desc(UserCourse.assigned_at))
+        .options(contains_eager(UserCourse.course))
         .distinct()
     )
 
@@ -50,88 +65,151 @@ def home():
 @bp.route("/course/<string:course_id>")
 @login_required
 def course(course_id):
-    if not db.session.get(UserCourse, ident=(current_user.user_id, course_id)):
+    user_course = db.session.get(UserCourse, ident=(current_user.user_id, course_id))
+    if not user_course:
         flash("Page you try to access is not found.", "warning")
         return redirect(url_for("base.home"))
 
-    course = db.session.get(Course, ident=course_id)
-    user_course = db.session.get(UserCourse, ident=(current_user.user_id, course_id))
+    etag, last_modified = get_course_page_validators(user_course)
+    if is_not_modified(etag):
+        return set_page_validators(make_response("", 304), etag, last_modified)
 
-    return render_template(
-        "base/course.html", course=course, user_course=user_course, title="Course"
+    course = db.session.get(Course, ident=course_id)
+    outline = courses.get_course_outline(course.course_id)
+
+    response = make_response(
+        render_template(
+            "base/course.html",
+            course=course,
+            outline=outline,
+            user_course=user_course,
+            title="Course",
+        )
     )
 
+    return set_page_validators(response, etag, last_modified)
+
 
 @bp.route("/course/<string:course_id>/lesson/<string:lesson_id>")
+@login_required
 def course_lesson(course_id: str, lesson_id: str):
     """Get Course Lesson"""
 
-    if not db.session.get(UserCourse, ident=(current_user.user_id, course_id)):
+    user_course = db.session.get(UserCourse, ident=(current_user.user_id, course_id))
+    if not user_course:
         flash("Page you try to access not found.", "warning")
         return redirect(url_for("base.home"))
 
-    course_lesson = db.session.get(CourseLesson, ident=(course_id, lesson_id))
-    if not course_lesson:
+    etag, last_modified = get_course_page_validators(user_course, lesson_id)
+    if is_not_modified(etag):
+        return set_page_validators(make_response("", 304), etag, last_modified)
+
+    outline = courses.get_course_outline(user_course.course_id)
+    lesson = db.session.get(Lesson, ident=lesson_id)
+    if not outline or not lesson or lesson.lesson_id not in outline:
         flash("Page you try to access not found.", "warning")
         return redirect(url_for("base.home"))
 
-    return render_template(
-        "base/course_lesson.html", course_lesson=course_lesson, title="Couse Lesson"
+    response = make_response(
+        render_template(
+            "base/course_lesson.html",
+            outline=outline,
+            lesson=lesson,
+            previous_lesson=outline.previous_lesson(lesson.lesson_id),
+            next_lesson=outline.next_lesson(lesson.lesson_id),
+            title="Couse Lesson",
+        )
     )
 
+    return set_page_validators(response, etag, last_modified)
 
-@bp.route("/dashboard")
+
+def _has_course_access(course_id: uuid.UUID) -> bool:
+    return bool(
+        current_user.is_staff
+        or current_user.is_superuser
+        or db.session.get(UserCourse, ident=(current_user.user_id, course_id))
+    )
+
+
+@bp.route("/course/<uuid:course_id>/attachment/<uuid:attachment_id>")
 @login_required
-def dashboard():
-    q_courses = request.args.get("q_courses", "")
+def course_attachment(course_id: uuid.UUID, attachment_id: uuid.UUID):
+    """Download Course Attachment"""
+
+    attachment = db.session.get(Attachment, ident=attachment_id)
+    if (
+        not attachment
+        or attachment.course_id != course_id
+        or not _has_course_access(course_id)
+    ):
+        flash("Page you try to access not found.", "warning")
+        return redirect(url_for("base.home"))
 
-    all_user_courses_count = db.session.execute(
-        select(func.count())
-        .select_from(UserCourse)
-        .filter(UserCourse.user_id == current_user.get_id())
-    ).scalar_one_or_none()
-
-    completed_user_courses_count = db.session.execute(
-        select(func.count())
-        .select_from(UserCourse)
-        .filter(UserCourse.user_id == current_user.get_id())
-        .filter(UserCourse.is_completed)
-    ).scalar_one_or_none()
-
-    all_user_assessments_count = db.session.execute(
-        select(func.count())
-        .select_from(UserAssessment)
-        .filter(UserAssessment.user_id == current_user.get_id())
-        .filter(UserAssessment.is_completed)
-    ).scalar_one_or_none()
-
-    total_learning_hours: timedelta | None = db.session.execute(
-        select(UserCourseLesson.closed_at - UserCourseLesson.opened_at).select_from(
-            UserCourseLesson
-        )
-    ).scalar_one_or_none()
+    return attachments.make_attachment_response(attachment)
 
-    if total_learning_hours:
-        total_learning_hours = total_learning_hours.total_seconds() * SECONDS_TO_HOURS
 
-    user_metrics = UserMetrics(
-        all_user_courses_count,
-        completed_user_courses_count,
-        all_user_assessments_count,
-        total_learning_hours,
-        3.4,
+@bp.route("/course/<uuid:course_id>/attachments.zip")
+@login_required
+def course_attachments_archive(course_id: uuid.UUID):
+    """Download Course Attachments Archive"""
+
+    course = db.session.get(Course, ident=course_id)
+    if not course or not _has_course_access(course_id):
+        flash("Page you try to access not found.", "warning")
+        return redirect(url_for("base.home"))
+
+    course_attachments = (
+        db.session.execute(
+            select(Attachment)
+            .filter(Attachment.course_id == course_id)
+            .order_by(Attachment.name)
+        )
+        .scalars()
+        .all()
     )
+    if not course_attachments:
+        flash("This course has no attachments yet.", "info")
+        return redirect(url_for("base.course", course_id=course_id))
 
-    user_courses = db.session.execute(
-        select(Course)
-        .select_from(Course)
-        .join(UserCourse)
-        .filter(
-            and_(
-                UserCourse.user_id == current_user.user_id,
-                Course.name.icontains(q_courses),
-            )
+    return attachments.make_course_archive_response(course, course_attachments)
+
+
+@bp.route("/course/<uuid:course_id>/lesson/<uuid:lesson_id>/progress", methods=["POST"])
+@login_required
+def course_lesson_progress(course_id: uuid.UUID, lesson_id: uuid.UUID):
+    """Lesson Progress Beacon"""
+
+    # Buffered as is, enrollments are checked once per batch when flushed.
+    try:
+        recorded = progress.record_event(
+            current_user.user_id, course_id, lesson_id, request.form.get("event", "")
         )
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    if not recorded:
+        return jsonify({"msg": "Busy"}), 503
+
+    return "", 204
+
+
+@bp.route("/dashboard")
+@login_required
+def dashboard():
+    q_courses = request.args.get("q_courses", "")
+
+    user_metrics = get_user_metrics(current_user.user_id)
+
+    user_courses = db.session.execute(
+        search.search(
+            select(Course)
+            .select_from(Course)
+            .join(UserCourse)
+            .filter(UserCourse.user_id == current_user.user_id),
+            (Course.name,),
+            q_courses,
+        ).order_by(Course.name)
     ).scalars()
 
     user_assessments = db.session.execute(
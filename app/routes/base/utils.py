@@ -1,3 +1,19 @@
+import hashlib
+import uuid
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from flask import current_app as app
+from flask import request, session
+from flask_login import current_user
+from sqlalchemy import select
+
+from ... import db
+from ...fragment_cache import get_course_scope
+from ...models import Course, DataVersion, Lesson, UserCourse, UserLearningStats
+from ...utils import SECONDS_TO_HOURS
+
+
 class UserMetrics:
     def __init__(
         self,
@@ -5,7 +21,7 @@ class UserMetrics:
         completed_courses_count: int = 0,
         assessments_count: int = 0,
         learning_hours: float = 0.0,
-        longest_strike: float = 0.0,
+        longest_strike: int = 0,
     ):
         self.courses_count = courses_count
         self.completed_courses_count = completed_courses_count
@@ -35,8 +51,101 @@ class UserMetrics:
 
     @property
     def longest_strike_fmt(self) -> str:
-        _days, _remaining_hours = self.calculate_duration(self.longest_strike)
-        if _days != 0:
-            return f"{_days} Days {_remaining_hours} Hours"
+        if self.longest_strike == 1:
+            return "1 Day"
 
-        return f"{_remaining_hours} Hours"
+        return f"{self.longest_strike} Days"
+
+
+def get_user_metrics(user_id: uuid.UUID) -> UserMetrics:
+    """Get the user dashboard metrics from his/her learning stats."""
+
+    stats = db.session.get(UserLearningStats, user_id)
+    if stats is None:
+        return UserMetrics()
+
+    return UserMetrics(
+        stats.courses_count,
+        stats.completed_courses_count,
+        stats.completed_assessments_count,
+        stats.learning_seconds * SECONDS_TO_HOURS,
+        stats.longest_streak,
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_templates_digest() -> str:
+    """Digest of the templates, so that deploying new ones changes the ETags."""
+
+    env = app.jinja_env
+    digest = hashlib.sha256()
+    for name in env.list_templates():
+        source, _filename, _uptodate = env.loader.get_source(env, name)
+        digest.update(name.encode("utf-8"))
+        digest.update(source.encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def get_course_page_validators(
+    user_course: UserCourse, lesson_id=None
+) -> tuple[str, datetime]:
+    """Get the strong ETag and Last-Modified date of a course or lesson page.
+
+    The page is rendered from the course or lesson content, stamped by its
+    content hash, the outline and attachments, stamped by the course data
+    version, the user enrollment and the current user shown in the nav.
+    """
+
+    if lesson_id is None:
+        stmt = select(Course.content_hash).filter(
+            Course.course_id == user_course.course_id
+        )
+    else:
+        stmt = select(Lesson.content_hash).filter(Lesson.lesson_id == lesson_id)
+
+    content_hash, version, updated_at = db.session.execute(
+        stmt.add_columns(DataVersion.version, DataVersion.updated_at).outerjoin(
+            DataVersion,
+            DataVersion.name == get_course_scope(user_course.course_id),
+        )
+    ).one_or_none() or (None, None, None)
+
+    stamp = (
+        _get_templates_digest(),
+        content_hash,
+        version,
+        user_course.course_id,
+        lesson_id,
+        user_course.assigned_at,
+        current_user.user_id,
+        current_user.fullname,
+        current_user.is_staff,
+        current_user.is_superuser,
+        current_user.permissions_version,
+    )
+    etag = hashlib.sha256(repr(stamp).encode("utf-8")).hexdigest()
+
+    last_modified = max(filter(None, (updated_at, user_course.assigned_at)))
+
+    return etag, last_modified.astimezone(timezone.utc)
+
+
+def is_not_modified(etag: str) -> bool:
+    """Check whether the client already holds the page with this ETag."""
+
+    # Templates reload in debug, and pending flash messages go into the page.
+    if app.debug or session.get("_flashes"):
+        return False
+
+    return request.if_none_match.contains_weak(etag)
+
+
+def set_page_validators(response, etag: str, last_modified: datetime):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Pages of the current user, the browser revalidates them on every visit.
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response
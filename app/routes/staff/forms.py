@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired
 from sqlalchemy import select
 from wtforms import (
     SelectField,
@@ -61,3 +62,9 @@ class AssignCourseLessonForm(FlaskForm):
         self.lesson.choices = empty_option + [
             (str(lesson.get_id()), lesson.name) for lesson in db_lessons
         ]
+
+
+class UploadAttachmentForm(FlaskForm):
+    name = StringField("Title", validators=[DataRequired(), Length(min=1, max=255)])
+    file = FileField("File", validators=[FileRequired()])
+    submit = SubmitField("Upload")
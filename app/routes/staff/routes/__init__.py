@@ -2,7 +2,7 @@ from flask import render_template, request
 from flask_login import current_user
 from sqlalchemy import not_, select
 
-from .... import db
+from .... import db, search
 from ....decorators import staff_user_required
 from ....models import Course, User
 from .. import bp
@@ -16,14 +16,17 @@ def panel():
     q_course = request.args.get("q_course", "")
 
     courses = db.session.execute(
-        select(Course).filter(Course.name.icontains(q_course))
+        search.search(select(Course), (Course.name,), q_course).order_by(Course.name)
     ).scalars()
 
     users = db.session.execute(
-        select(User)
-        .filter(User.fullname.icontains(q_user))
-        .filter(not_(User.is_superuser))
-        .filter(User.group_id == current_user.group_id)
+        search.search(
+            select(User)
+            .filter(not_(User.is_superuser))
+            .filter(User.group_id == current_user.group_id),
+            (User.fullname,),
+            q_user,
+        ).order_by(User.fullname)
     ).scalars()
 
     return render_template(
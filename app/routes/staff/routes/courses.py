@@ -5,14 +5,15 @@ from flask import (
     flash,
     redirect,
     render_template,
+    request,
     url_for,
 )
 from flask_login import current_user
 from sqlalchemy import not_, select
 
-from .... import consts, db
+from .... import attachments, consts, courses, db, sanitizer
 from ....decorators import permission_required
-from ....models import Course, CourseLesson, Lesson, User, UserCourse
+from ....models import Attachment, Course, CourseLesson, Lesson, User, UserCourse
 from .. import bp
 from ..forms import (
     AssignCourseLessonForm,
@@ -20,6 +21,7 @@ from ..forms import (
     AssignUserCourseForm,
     NewCourseForm,
     NewLessonForm,
+    UploadAttachmentForm,
 )
 
 
@@ -40,10 +42,13 @@ def add_new_course():
             flash(f"Couse with name <b>{name}</b> already exist.", "warning")
             return redirect(url_for("staff.add_new_course"))
 
+        content_html, content_hash = sanitizer.render_content(content)
         course = Course(
             name=name,
             summary=summary,
             content=content,
+            content_html=content_html,
+            content_hash=content_hash,
         )
 
         try:
@@ -201,10 +206,13 @@ def add_new_lesson():
         content = form.content.data
         index = 1
 
+        content_html, content_hash = sanitizer.render_content(content)
         lesson = Lesson(
             name=name,
             index=index,
             content=content,
+            content_html=content_html,
+            content_hash=content_hash,
         )
 
         try:
@@ -255,6 +263,7 @@ def assign_course_lesson(course_id: str):
         try:
             db.session.add(course_lesson)
             db.session.commit()
+            courses.invalidate_course_outline(course_lesson.course_id)
             flash("Lesson assigned successfully for the course", "success")
             return redirect(url_for("staff.panel"))
         except Exception as e:
@@ -265,3 +274,80 @@ def assign_course_lesson(course_id: str):
     return render_template(
         "staff/assign_course_lesson.html", form=form, title="Assign Lesson"
     )
+
+
+@bp.route("course-attachments/<string:course_id>", methods=["GET", "POST"])
+@permission_required(consts.PermissionEnum.CAN_CREATE_COURSE)
+def upload_course_attachment(course_id: str):
+    """Upload Course Attachment"""
+
+    course = db.session.get(Course, course_id)
+    if not course:
+        flash(f"Course with id: {course_id} is not found.", "warning")
+        return redirect(url_for("staff.panel"))
+
+    store = attachments.get_store()
+    max_size = attachments.get_upload_max_size(course.course_id)
+
+    # Parsed here rather than by the form, so the file is streamed into the
+    # store instead of being spooled.
+    formdata, uploads = None, []
+    if request.method == "POST":
+        try:
+            formdata, uploads = attachments.parse_upload(store, max_size)
+        except attachments.AttachmentQuotaError as e:
+            flash(str(e), "warning")
+            return redirect(
+                url_for("staff.upload_course_attachment", course_id=course_id)
+            )
+
+    form = UploadAttachmentForm(formdata=formdata)
+
+    try:
+        if form.validate_on_submit():
+            name = form.name.data
+
+            if not form.file.data.stream.size:
+                flash("The uploaded file is empty.", "warning")
+                return redirect(
+                    url_for("staff.upload_course_attachment", course_id=course_id)
+                )
+
+            try:
+                attachments.add_attachment(
+                    store,
+                    course.course_id,
+                    name,
+                    form.file.data.filename,
+                    form.file.data.stream,
+                )
+                db.session.commit()
+                flash(f"Attachment <b>{name}</b> uploaded successfully.", "success")
+                return redirect(
+                    url_for("staff.upload_course_attachment", course_id=course_id)
+                )
+            except attachments.AttachmentQuotaError as e:
+                db.session.rollback()
+                flash(str(e), "warning")
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(e)
+                flash("Something went wrong, Please try again later.", "danger")
+    finally:
+        for upload in uploads:
+            upload.discard()
+
+    course_attachments = db.session.execute(
+        select(Attachment)
+        .filter(Attachment.course_id == course.course_id)
+        .order_by(Attachment.name)
+    ).scalars()
+
+    return render_template(
+        "staff/upload_course_attachment.html",
+        form=form,
+        course=course,
+        attachments=course_attachments,
+        max_size=max_size,
+        title="Course Attachments",
+    )
@@ -0,0 +1,83 @@
+import hashlib
+import threading
+
+import bleach
+
+# Markup produced by the lesson and course rich text editor.
+ALLOWED_TAGS = frozenset(
+    {
+        "a",
+        "b",
+        "blockquote",
+        "br",
+        "code",
+        "div",
+        "em",
+        "figcaption",
+        "figure",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "hr",
+        "i",
+        "img",
+        "li",
+        "ol",
+        "p",
+        "pre",
+        "s",
+        "span",
+        "strong",
+        "sub",
+        "sup",
+        "table",
+        "tbody",
+        "td",
+        "tfoot",
+        "th",
+        "thead",
+        "tr",
+        "u",
+        "ul",
+    }
+)
+ALLOWED_ATTRIBUTES = {
+    "*": ["class"],
+    "a": ["href", "title", "target", "rel"],
+    "img": ["src", "alt", "title", "width", "height"],
+    "td": ["colspan", "rowspan"],
+    "th": ["colspan", "rowspan"],
+}
+ALLOWED_PROTOCOLS = frozenset({"http", "https", "mailto"})
+
+# Cleaners keep parser state, so every thread gets its own.
+_local = threading.local()
+
+
+def _get_cleaner() -> bleach.Cleaner:
+    cleaner = getattr(_local, "cleaner", None)
+    if cleaner is None:
+        cleaner = bleach.Cleaner(
+            tags=ALLOWED_TAGS,
+            attributes=ALLOWED_ATTRIBUTES,
+            protocols=ALLOWED_PROTOCOLS,
+            strip=True,
+        )
+        _local.cleaner = cleaner
+    return cleaner
+
+
+def sanitize_html(html: str | None) -> str:
+    """Strip the tags, attributes and protocols that are not allowed."""
+
+    return _get_cleaner().clean(html or "")
+
+
+def render_content(content: str | None) -> tuple[str, str]:
+    """Sanitize the editor content, returning its html and the html hash."""
+
+    html = sanitize_html(content)
+    return html, hashlib.sha256(html.encode("utf-8")).hexdigest()
@@ -0,0 +1,32 @@
+from flask import current_app as app
+from sqlalchemy import Select, func, or_
+
+
+def _contains_pattern(q: str) -> str:
+    escaped = q.replace("/", "//").replace("%", "/%").replace("_", "/_")
+    return f"%{escaped}%"
+
+
+def search(stmt: Select, columns: tuple, q: str, limit: int | None = None) -> Select:
+    """Filter the statement to the rows with a column containing `q`.
+
+    The filter is an ILIKE on a constant pattern, which postgres answers
+    from the columns trigram indexes, the rows are ranked by their best
+    trigram similarity to `q`, and limited to `SEARCH_RESULT_LIMIT`.
+    Without `q` the statement is returned as is, listing every row.
+    """
+
+    q = q.strip()
+    if not q:
+        return stmt
+
+    pattern = _contains_pattern(q)
+    limit = limit or app.config.get("SEARCH_RESULT_LIMIT", 50)
+
+    return (
+        stmt.filter(or_(*(column.ilike(pattern, escape="/") for column in columns)))
+        .order_by(
+            func.greatest(*(func.similarity(column, q) for column in columns)).desc()
+        )
+        .limit(limit)
+    )
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app as app
+
+_lock = threading.Lock()
+_limiters: dict[str, "TokenBucketLimiter"] = {}
+
+_metrics = {
+    "allowed": 0,
+    "rejected_by_ip": 0,
+    "rejected_by_username": 0,
+}
+
+
+class TokenBucketLimiter:
+    """Token buckets held in the worker memory, one bucket per key.
+
+    Each bucket holds up to `capacity` tokens and refills continuously at
+    `refill_per_second`, the least recently used buckets are evicted once
+    there are more than `max_keys` of them.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float, max_keys: int):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, tokens: float = 1.0) -> bool:
+        """Take tokens from the key bucket, returning False if it is empty."""
+
+        now = time.monotonic()
+
+        with self._lock:
+            available, updated_at = self._buckets.pop(key, (self.capacity, now))
+            available = min(
+                self.capacity,
+                available + (now - updated_at) * self.refill_per_second,
+            )
+
+            allowed = available >= tokens
+            if allowed:
+                available -= tokens
+
+            self._buckets[key] = (available, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def _get_limiter(name: str) -> TokenBucketLimiter:
+    limiter = _limiters.get(name)
+
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                prefix = f"LOGIN_THROTTLE_{name.upper()}"
+                limiter = TokenBucketLimiter(
+                    capacity=app.config.get(f"{prefix}_BURST", 10),
+                    refill_per_second=app.config.get(f"{prefix}_PER_MINUTE", 10) / 60,
+                    max_keys=app.config.get("LOGIN_THROTTLE_MAX_KEYS", 100_000),
+                )
+                _limiters[name] = limiter
+
+    return limiter
+
+
+def allow_login_attempt(username: str, remote_addr: str | None) -> bool:
+    """Check the login attempt against the ip and username buckets."""
+
+    if not app.config.get("LOGIN_THROTTLE_ENABLED", True):
+        return True
+
+    if not _get_limiter("ip").consume(remote_addr or "unknown"):
+        with _lock:
+            _metrics["rejected_by_ip"] += 1
+        return False
+
+    if not _get_limiter("username").consume(username.strip().lower()):
+        with _lock:
+            _metrics["rejected_by_username"] += 1
+        return False
+
+    with _lock:
+        _metrics["allowed"] += 1
+
+    return True
+
+
+def get_metrics() -> dict:
+    """Snapshot of the login throttling counters of this worker."""
+
+    with _lock:
+        metrics = dict(_metrics)
+
+    metrics["tracked_ips"] = len(_limiters["ip"]) if "ip" in _limiters else 0
+    metrics["tracked_usernames"] = (
+        len(_limiters["username"]) if "username" in _limiters else 0
+    )
+
+    return metrics
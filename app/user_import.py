@@ -0,0 +1,276 @@
+import csv
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import IO
+
+from flask import current_app as app
+from flask_bcrypt import generate_password_hash
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from . import db, permissions
+from .models import Group, User
+
+REQUIRED_COLUMNS = ("username", "fullname")
+
+TRUE_VALUES = {"1", "true", "yes", "y", "t"}
+FALSE_VALUES = {"", "0", "false", "no", "n", "f"}
+
+
+class ImportRowError:
+    def __init__(self, line: int, username: str, message: str):
+        self.line = line
+        self.username = username
+        self.message = message
+
+
+class ImportReport:
+    def __init__(self):
+        self.created_count = 0
+        self.errors: list[ImportRowError] = []
+
+    @property
+    def rows_count(self) -> int:
+        return self.created_count + len(self.errors)
+
+    def add_error(self, line: int, username: str, message: str) -> None:
+        self.errors.append(ImportRowError(line, username, message))
+
+
+def _hash_password(password: str, rounds: int) -> str:
+    # Runs in the pool processes, must stay a module level function.
+    return generate_password_hash(password, rounds).decode("utf-8")
+
+
+def _parse_bool(value: str | None, default: bool) -> bool:
+    if value is None:
+        return default
+
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False if value else default
+
+    raise ValueError(f"Invalid boolean value {value!r}")
+
+
+def _read_rows(reader: csv.DictReader, report: ImportReport):
+    """Yield the rows with their line, until the end or an unreadable part.
+
+    An unreadable part ends the import with an error in the report instead of
+    raising, as the earlier chunks are committed by then.
+    """
+
+    # Line numbers are those of the file, taken as each row is read since
+    # blank lines are skipped and quoted values may span lines, a row is
+    # reported at its last line.
+    try:
+        for row in reader:
+            yield reader.line_num, row
+    except (UnicodeDecodeError, csv.Error) as e:
+        report.add_error(
+            reader.line_num + 1, "", f"The file cannot be read from here on: {e}"
+        )
+
+
+def _load_groups() -> dict[str, uuid.UUID]:
+    groups = {}
+    for group in db.session.execute(select(Group)).scalars():
+        groups[group.name.lower()] = group.group_id
+        groups[group.abbreviation.lower()] = group.group_id
+    return groups
+
+
+def _validate_row(
+    row: dict, groups: dict[str, uuid.UUID], registered_by_id: uuid.UUID
+) -> dict:
+    """Validate a csv row, and convert it to `users` insert values."""
+
+    username = (row.get("username") or "").strip()
+    fullname = (row.get("fullname") or "").strip()
+    group = (row.get("group") or "").strip()
+
+    if not 4 <= len(username) <= 25:
+        raise ValueError("Username must be between 4 and 25 characters long")
+
+    if not fullname or len(fullname) > 255:
+        raise ValueError("Fullname is required and at most 255 characters long")
+
+    group_id = None
+    if group:
+        group_id = groups.get(group.lower())
+        if group_id is None:
+            raise ValueError(f"Group {group!r} does not exist")
+
+    now = datetime.now()
+
+    return {
+        "user_id": uuid.uuid4(),
+        "username": username,
+        "fullname": fullname,
+        "group_id": group_id,
+        "is_active": _parse_bool(row.get("is_active"), True),
+        "is_staff": _parse_bool(row.get("is_staff"), False),
+        "is_superuser": _parse_bool(row.get("is_superuser"), False),
+        "permissions_version": 0,
+        "registered_at": now,
+        "registered_by_id": registered_by_id,
+        "last_login": now,
+    }
+
+
+def _validate_chunk(
+    chunk: list[tuple[int, dict]],
+    groups: dict[str, uuid.UUID],
+    registered_by_id: uuid.UUID,
+    report: ImportReport,
+    seen_usernames: set[str],
+) -> dict[int, dict]:
+    """Validate the chunk rows, returning insert values by line number."""
+
+    values_by_line = {}
+    for line, row in chunk:
+        username = (row.get("username") or "").strip()
+        try:
+            values = _validate_row(row, groups, registered_by_id)
+        except ValueError as e:
+            report.add_error(line, username, str(e))
+            continue
+
+        if username.lower() in seen_usernames:
+            report.add_error(line, username, "Duplicate username in the file")
+            continue
+
+        seen_usernames.add(username.lower())
+        values_by_line[line] = values
+
+    if not values_by_line:
+        return values_by_line
+
+    usernames = [values["username"] for values in values_by_line.values()]
+    existing_usernames = set(
+        db.session.execute(
+            select(User.username).filter(User.username.in_(usernames))
+        ).scalars()
+    )
+
+    for line, values in list(values_by_line.items()):
+        if values["username"] in existing_usernames:
+            report.add_error(line, values["username"], "Username already exists")
+            del values_by_line[line]
+
+    return values_by_line
+
+
+def _insert_chunk(
+    values_by_line: dict[int, dict],
+    executor: ProcessPoolExecutor,
+    workers: int,
+    report: ImportReport,
+) -> None:
+    """Hash passwords of the chunk rows and insert them in one statement."""
+
+    # Every user gets his/her own salt, even with the same initial password.
+    password = app.config.get("DEFAULT_USER_PASSWORD", "P@ssw0rd")
+    rounds = app.config.get("BCRYPT_LOG_ROUNDS", 12)
+    rows = list(values_by_line.values())
+    password_hashes = executor.map(
+        _hash_password,
+        [password] * len(rows),
+        [rounds] * len(rows),
+        chunksize=max(1, len(rows) // (workers * 4)),
+    )
+    for values, password_hash in zip(rows, password_hashes, strict=True):
+        values["password_hash"] = password_hash
+
+    stmt = (
+        pg_insert(User)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["username"])
+        .returning(User.user_id, User.username)
+    )
+    inserted = dict(db.session.execute(stmt).all())
+
+    # Bulk inserts skip the mapper events, materialize group grants here.
+    permissions.grant_group_permissions_to_users(
+        db.session.connection(), list(inserted)
+    )
+    db.session.commit()
+
+    inserted_usernames = set(inserted.values())
+    for line, values in values_by_line.items():
+        if values["username"] in inserted_usernames:
+            report.created_count += 1
+        else:
+            report.add_error(line, values["username"], "Username already exists")
+
+
+def import_users(
+    stream: IO[str],
+    registered_by_id: uuid.UUID,
+    chunk_size: int | None = None,
+    workers: int | None = None,
+    max_rows: int | None = None,
+) -> ImportReport:
+    """Import users from a csv stream, chunk by chunk.
+
+    The csv must have `username` and `fullname` columns, and may have `group`
+    (name or abbreviation), `is_active`, `is_staff` and `is_superuser` columns.
+    Rows are committed per chunk, failing rows are reported and skipped.
+    Passwords are hashed by up to `workers` processes, and rows past
+    `max_rows` are reported and skipped.
+    """
+
+    chunk_size = chunk_size or app.config.get("USER_IMPORT_CHUNK_SIZE", 1000)
+    workers = workers or app.config.get("USER_IMPORT_HASHING_WORKERS", 2)
+    workers = max(1, min(workers, os.cpu_count() or 1))
+    report = ImportReport()
+
+    reader = csv.DictReader(stream)
+    columns = {column.strip().lower() for column in reader.fieldnames or []}
+    missing_columns = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing_columns:
+        raise ValueError(f"Missing csv columns: {', '.join(missing_columns)}")
+
+    reader.fieldnames = [column.strip().lower() for column in reader.fieldnames]
+    groups = _load_groups()
+    seen_usernames: set[str] = set()
+
+    rows = _read_rows(reader, report)
+    if max_rows:
+        rows = islice(rows, max_rows)
+
+    # Forked from a threaded worker, the children could inherit locks held by
+    # its other threads, so they are started from a clean forkserver process.
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("forkserver")
+    ) as executor:
+        while chunk := list(islice(rows, chunk_size)):
+            values_by_line = _validate_chunk(
+                chunk, groups, registered_by_id, report, seen_usernames
+            )
+            if not values_by_line:
+                continue
+
+            try:
+                _insert_chunk(values_by_line, executor, workers, report)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(e)
+                for line, values in values_by_line.items():
+                    report.add_error(line, values["username"], "Database error")
+
+    if max_rows and next(_read_rows(reader, report), None) is not None:
+        report.add_error(
+            reader.line_num,
+            "",
+            f"Only the first {max_rows} rows can be imported here, "
+            "import larger files with `flask admin import-users`",
+        )
+
+    return report
@@ -0,0 +1,38 @@
+"""Store audit_logs changed_data as JSONB
+
+Revision ID: 1e6b3d9f4a70
+Revises: c7a94e15d2f8
+Create Date: 2024-11-15 11:22:08.913460
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '1e6b3d9f4a70'
+down_revision = 'c7a94e15d2f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Previous rows only hold the "{}" placeholders, they carry no changes.
+    op.alter_column('audit_logs', 'changed_data',
+               existing_type=sa.Text(),
+               type_=postgresql.JSONB(astext_type=sa.Text()),
+               existing_nullable=True,
+               postgresql_using='NULL::jsonb')
+    op.create_index('ix_audit_logs_table_name_object_id', 'audit_logs', ['table_name', 'object_id'], unique=False)
+    op.create_index('ix_audit_logs_changed_data', 'audit_logs', ['changed_data'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_audit_logs_changed_data', table_name='audit_logs', postgresql_using='gin')
+    op.drop_index('ix_audit_logs_table_name_object_id', table_name='audit_logs')
+    op.alter_column('audit_logs', 'changed_data',
+               existing_type=postgresql.JSONB(astext_type=sa.Text()),
+               type_=sa.Text(),
+               existing_nullable=True,
+               postgresql_using='changed_data::text')
@@ -0,0 +1,32 @@
+"""Add audit_logs keyset pagination indexes
+
+Revision ID: 4a8e2c6b1d93
+Revises: 1e6b3d9f4a70
+Create Date: 2024-11-18 09:41:27.215803
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a8e2c6b1d93'
+down_revision = '1e6b3d9f4a70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_audit_logs_table_name_object_id', table_name='audit_logs')
+    op.create_index('ix_audit_logs_table_name_object_id', 'audit_logs', ['table_name', 'object_id', 'timestamp', 'audit_log_id'], unique=False)
+    op.create_index('ix_audit_logs_table_name', 'audit_logs', ['table_name', 'timestamp', 'audit_log_id'], unique=False)
+    op.create_index('ix_audit_logs_timestamp', 'audit_logs', ['timestamp', 'audit_log_id'], unique=False)
+    op.create_index('ix_audit_logs_user_id', 'audit_logs', ['user_id', 'timestamp', 'audit_log_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_audit_logs_user_id', table_name='audit_logs')
+    op.drop_index('ix_audit_logs_timestamp', table_name='audit_logs')
+    op.drop_index('ix_audit_logs_table_name', table_name='audit_logs')
+    op.drop_index('ix_audit_logs_table_name_object_id', table_name='audit_logs')
+    op.create_index('ix_audit_logs_table_name_object_id', 'audit_logs', ['table_name', 'object_id'], unique=False)
@@ -0,0 +1,85 @@
+"""Partition audit_logs by month
+
+Revision ID: c7a94e15d2f8
+Revises: 8d2c4f7a0b63
+Create Date: 2024-11-12 16:05:41.372519
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a94e15d2f8'
+down_revision = '8d2c4f7a0b63'
+branch_labels = None
+depends_on = None
+
+
+def _add_months(month, months):
+    years, month_index = divmod(month.month - 1 + months, 12)
+    return date(month.year + years, month_index + 1, 1)
+
+
+def upgrade():
+    op.rename_table('audit_logs', 'audit_logs_legacy')
+    op.execute('ALTER TABLE audit_logs_legacy RENAME CONSTRAINT audit_logs_pkey TO audit_logs_legacy_pkey')
+    op.execute('ALTER TABLE audit_logs_legacy RENAME CONSTRAINT audit_logs_user_id_fkey TO audit_logs_legacy_user_id_fkey')
+
+    op.create_table('audit_logs',
+    sa.Column('audit_log_id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.Column('object_id', sa.String(length=255), nullable=False),
+    sa.Column('flag', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(length=255), nullable=False),
+    sa.Column('changed_data', sa.Text(), nullable=True),
+    sa.Column('justification', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('audit_log_id', 'timestamp'),
+    postgresql_partition_by='RANGE (timestamp)'
+    )
+
+    # Monthly partitions for the existing rows and the coming months.
+    bind = op.get_bind()
+    first_timestamp = bind.execute(sa.text('SELECT min(timestamp) FROM audit_logs_legacy')).scalar()
+    current_month = date.today().replace(day=1)
+    month = first_timestamp.date().replace(day=1) if first_timestamp else current_month
+    while month <= _add_months(current_month, 3):
+        op.execute(
+            f"CREATE TABLE audit_logs_y{month:%Y}m{month:%m} PARTITION OF audit_logs "
+            f"FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}')"
+        )
+        month = _add_months(month, 1)
+    op.execute('CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT')
+
+    op.execute(
+        'INSERT INTO audit_logs '
+        '(audit_log_id, user_id, timestamp, object_id, flag, table_name, changed_data, justification) '
+        'SELECT audit_log_id, user_id, timestamp, object_id, flag, table_name, changed_data, justification '
+        'FROM audit_logs_legacy'
+    )
+    op.drop_table('audit_logs_legacy')
+
+
+def downgrade():
+    op.rename_table('audit_logs', 'audit_logs_partitioned')
+
+    op.create_table('audit_logs',
+    sa.Column('audit_log_id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.Column('object_id', sa.String(length=255), nullable=False),
+    sa.Column('flag', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(length=255), nullable=False),
+    sa.Column('changed_data', sa.Text(), nullable=True),
+    sa.Column('justification', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], name='audit_logs_legacy_user_id_fkey'),
+    sa.PrimaryKeyConstraint('audit_log_id', name='audit_logs_legacy_pkey')
+    )
+    op.execute('INSERT INTO audit_logs SELECT * FROM audit_logs_partitioned')
+    op.drop_table('audit_logs_partitioned')
+    op.execute('ALTER TABLE audit_logs RENAME CONSTRAINT audit_logs_legacy_pkey TO audit_logs_pkey')
+    op.execute('ALTER TABLE audit_logs RENAME CONSTRAINT audit_logs_legacy_user_id_fkey TO audit_logs_user_id_fkey')
@@ -5,4 +5,7 @@ echo "Upgrading Database..."
 flask db upgrade
 echo "Database Upgraded Successfully."
 
+echo "Creating Audit Log Partitions..."
+flask admin audit-partitions
+
 python /app/initialize_data.py
\ No newline at end of file